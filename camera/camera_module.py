@@ -1,20 +1,30 @@
 import os
+import atexit
+import re
+import sys
+import json
 import time
 import queue
+import shutil
 import threading
-from datetime import datetime
-from collections import deque
+import subprocess
 from threading import Lock
 from progressive_enroll import should_collect, get_policy, record_accepted_clip
+from config_manager import local_time
 from camera.video_quality import score_video
 import cv2
-from picamera2 import Picamera2
+import numpy as np
+from picamera2 import Picamera2, MappedArray
 
 
 # Stability / OpenCV
 
 cv2.setNumThreads(1)
 
+# Transparent API: run MOG2 and the mask filtering on an OpenCL device when one exists
+cv2.ocl.setUseOpenCL(True)
+USE_OPENCL = cv2.ocl.haveOpenCL() and cv2.ocl.useOpenCL()
+
 
 # Log + GUI preview state
 
@@ -26,14 +36,21 @@ def set_camera_logger(func):
     log_event = func
 
 
-_latest_frame = None          # BGR frame for GUI 
+_latest_frame = None          # I420 ring frame for GUI 
 _recording_status = "Not Recording"
 frame_lock = Lock()
 
 
-def get_latest_frame_and_status():
+def get_latest_frame_and_status(dst=None):
     with frame_lock:
-        return (None if _latest_frame is None else _latest_frame.copy()), _recording_status
+        frame, status = _latest_frame, _recording_status
+    # the conversion produces the copy the caller gets (main stream byte order); pass
+    # the previous result as dst to have it converted into that buffer again
+    return (None if frame is None else _ring_to_main(frame, dst)), status
+
+
+def _ring_to_main(i420, dst=None):
+    return cv2.cvtColor(i420, RING_TO_MAIN, dst=dst)
 
 
 def _set_status(s: str):
@@ -45,9 +62,14 @@ def _set_status(s: str):
 
 # Configuration
 MAIN_SIZE = (1280, 720)      # output video (reasonable resolution for CPU)
-RING_SIZE = (960, 540)       # pre-roll in RAM (smaller than MAIN to save memory)
-LORES_SIZE = (424, 240)      # for detection
+RING_SIZE = (960, 540)       # pre-roll in RAM (ISP lores stream, I420)
+# Picamera2 "BGR888" lays main pixels out R,G,B in memory; lores frames are converted
+# to that same byte order so pre-roll, post-roll, preview and detector all agree
+RING_TO_MAIN = cv2.COLOR_YUV2RGB_I420
+LORES_SIZE = (424, 240)      # detection scale
 FPS = 12.0
+FRAME_US = int(1e6 / FPS)    # sensor frame duration
+CAMERA_BUFFERS = 4           # Picamera2 request buffers (main + lores per buffer)
 
 RECOG_PRE_SEC = 20           # recognized: 20 s before
 RECOG_POST_SEC = 10          # recognized: 10 s after
@@ -57,11 +79,44 @@ UNREC_TAIL_SEC = 10          # unrecognized: 10 s after last detected human moti
 # MOG2 thresholds (on low-res)
 MOG_HISTORY = 300
 MOG_VARTHRESH = 16
-MOTION_MIN_AREA = 1200       # tune per scene
-
-# HOG people-detector (not every frame)
+MOTION_MIN_AREA = 1200       # tune per scene (in LORES pixels)
+MOG_DOWNSCALE = 2            # MOG2 input is LORES / MOG_DOWNSCALE per side
+MOG_SIZE = (LORES_SIZE[0] // MOG_DOWNSCALE, LORES_SIZE[1] // MOG_DOWNSCALE)
+MOG_MIN_AREA = MOTION_MIN_AREA / (MOG_DOWNSCALE * MOG_DOWNSCALE)
+MOTION_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))  # mask denoise (open)
+DIFF_THRESH = 18             # frame-difference gate: per-pixel u8 threshold
+DIFF_CONFIRM_N = 2           # consecutive differing frames before MOG2 is consulted
+MOG_IDLE_EVERY_N = 3         # detection cadence while the scene is idle / refresh cadence while not needed
+ACTIVITY_ALPHA = 0.3         # EMA weight of the per-frame difference mass
+ACTIVITY_IDLE = MOG_MIN_AREA / 2  # EMA below this: scene idle, detect every MOG_IDLE_EVERY_N frames
+
+# Person detector (not every frame): MobileNet-SSD if the model is present, else HOG
 HOG_EVERY_N = 2
-HOG_WIN_STRIDE = (8, 8)
+SSD_INPUT_SIZE = (300, 300)
+SSD_SCALE = 0.007843
+SSD_MEAN = 127.5
+SSD_PERSON_CLASS = 15        # VOC "person"
+SSD_CONFIDENCE = 0.5
+HOG_WINDOW = (64, 128)       # HOG fallback: fixed windows scored against the people SVM
+HOG_ROI_SCALES = (1.0, 0.66) # window height as a fraction of the frame height
+FACE_MIN_SIZE = (20, 20)
+FACE_MAX_SIZE = (LORES_SIZE[1] // 2, LORES_SIZE[1] // 2)  # caps the cascade pyramid
+MOTION_ROI_PAD = 16          # px (LORES) around the largest motion blob for the Haar cascades
+HOG_CONFIRM_N = 6            # motion frames without a window hit before a multi-scale HOG pass
+HOG_CONFIRM_STRIDE = (8, 8)
+HOG_CONFIRM_SCALE = 1.1
+
+# VideoWriter buffer pools (frames in flight between capture and encoder)
+WRITER_BUFFERS = 8
+WRITER_BATCH = 4             # frames per hand-off to the writer thread
+# recognized clips hold the whole post-roll while the pre-roll drains (~2.7 MB per 720p
+# frame; np.empty pages are only committed once the LIFO pool actually reaches them)
+RECOG_WRITER_BUFFERS = int(RECOG_POST_SEC * FPS) + 2 * WRITER_BATCH
+WRITER_PUSH_TIMEOUT = 0.01   # s to wait for a free buffer before dropping a frame
+
+# Clip scoring runs in a child interpreter (all cores for OpenCV there)
+SCORE_TIMEOUT = 300          # s
+PKG_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # Paths
 BASE_DIR = "recordings"
@@ -72,7 +127,7 @@ os.makedirs(REC_DIR_UNRECOGNIZED, exist_ok=True)
 
 
 def _ts() -> str:
-    return datetime.now().strftime("%Y%m%d_%H%M%S")
+    return local_time("%Y%m%d_%H%M%S")
 
 
 def _recognized_path(user_id: int) -> str:
@@ -86,30 +141,84 @@ def _unrecognized_path() -> str:
     return os.path.join(REC_DIR_UNRECOGNIZED, f"{_ts()}_UNKNOWN.avi")
 
 
+# Hardware H.264: the Pi's V4L2 M2M encoder through OpenCV's GStreamer backend, same
+# .avi container; without GStreamer (or if the pipeline fails to open) XVID is used
+H264_BITRATE = 4_000_000
+USE_HW_H264 = re.search(r"GStreamer:\s*YES", cv2.getBuildInformation()) is not None
+
+
+def _h264_pipeline(filename: str) -> str:
+    return (
+        "appsrc ! videoconvert ! video/x-raw,format=I420 ! "
+        f'v4l2h264enc extra-controls="controls,video_bitrate={H264_BITRATE}" ! '
+        "video/x-h264,level=(string)4 ! h264parse ! avimux ! "
+        f"filesink location={filename}"
+    )
+
+
+def _open_video_writer(filename: str, fps: float, frame_size, fourcc_str: str):
+    if USE_HW_H264:
+        writer = cv2.VideoWriter(_h264_pipeline(filename), cv2.CAP_GSTREAMER, 0, fps, frame_size, True)
+        if writer.isOpened():
+            return writer, "H.264 (v4l2h264enc)"
+        writer.release()
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*fourcc_str), fps, frame_size)
+    return writer, fourcc_str
+
+
 # Background VideoWriter
+# Frames are copied from the camera buffer into a small pool of preallocated buffers
+# (waiting briefly, then dropping, when all are in flight) and handed to the worker
+# in batches of WRITER_BATCH; the worker returns each buffer once written. An optional
+# pre-roll is written by the worker before live frames, then preroll_done() is called.
 class VideoWriterThread:
-    def __init__(self, filename: str, frame_size=(1280, 720), fps=12.0, fourcc_str="XVID"):
+    def __init__(self, filename: str, frame_size=(1280, 720), fps=12.0, fourcc_str="XVID",
+                 buffers=WRITER_BUFFERS, preroll=None, preroll_done=None):
         self.filename = filename
-        fourcc = cv2.VideoWriter_fourcc(*fourcc_str)
-        self.writer = cv2.VideoWriter(filename, fourcc, fps, frame_size)
+        self.frame_size = tuple(frame_size)
+        self.writer, self.encoder = _open_video_writer(filename, fps, self.frame_size, fourcc_str)
         if not self.writer.isOpened():
+            if preroll_done:
+                preroll_done()
             raise RuntimeError(f"VideoWriter failed to open: {filename}")
 
-        self.q = queue.Queue(maxsize=1024)
+        w, h = self.frame_size
+        self._bufs = [np.empty((h, w, 3), np.uint8) for _ in range(int(buffers))]
+        self._free = queue.LifoQueue()  # LIFO: reuse the most recently written buffer
+        for i in range(len(self._bufs)):
+            self._free.put(i)
+        self._filled = queue.SimpleQueue()
+        self._batch = []
+        self._preroll = preroll
+        self._preroll_done = preroll_done
         self.stop_flag = threading.Event()
         self.t = threading.Thread(target=self._run, daemon=True)
         self.t.start()
 
     def _run(self):
         try:
-            while not self.stop_flag.is_set():
+            if self._preroll is not None:
+                # pre-roll frames are RING_SIZE I420: convert + upscale here, off the capture thread
                 try:
-                    frame = self.q.get(timeout=0.2)
+                    for frame in self._preroll:
+                        bgr = _ring_to_main(frame)
+                        self.writer.write(cv2.resize(bgr, self.frame_size, interpolation=cv2.INTER_LINEAR))
+                finally:
+                    self._preroll = None
+                    if self._preroll_done:
+                        self._preroll_done()
+            while True:
+                try:
+                    batch = self._filled.get(timeout=0.2)
                 except queue.Empty:
+                    if self.stop_flag.is_set():
+                        break
                     continue
-                if frame is None:  # shutdown signal
+                if batch is None:  # shutdown signal
                     break
-                self.writer.write(frame)
+                for i in batch:
+                    self.writer.write(self._bufs[i])
+                    self._free.put(i)
         finally:
             try:
                 self.writer.release()
@@ -117,32 +226,71 @@ class VideoWriterThread:
                 pass
 
     def push(self, bgr_frame):
-        if not self.stop_flag.is_set():
-            try:
-                self.q.put_nowait(bgr_frame.copy())
-            except queue.Full:
-                # Drop if full to avoid blocking
-                pass
+        if self.stop_flag.is_set():
+            return
+        try:
+            i = self._free.get(timeout=WRITER_PUSH_TIMEOUT)
+        except queue.Empty:
+            # Drop if every buffer stays in flight (never stall capture for long)
+            return
+        np.copyto(self._bufs[i], bgr_frame)
+        self._batch.append(i)
+        if len(self._batch) >= WRITER_BATCH:
+            self._filled.put(self._batch)
+            self._batch = []
 
     def close(self):
         if not self.stop_flag.is_set():
             self.stop_flag.set()
-            try:
-                self.q.put_nowait(None)
-            except queue.Full:
-                pass
+            if self._batch:
+                self._filled.put(self._batch)
+                self._batch = []
+            self._filled.put(None)
         self.t.join(timeout=2.0)
 
 
 
+# Pre-roll ring: one preallocated (N, H*3/2, W) block of I420 frames (the ISP's
+# RING_SIZE lores stream, copied into its slot). hold() returns the slots oldest-first
+# as views for a writer to drain; until release(), new frames bypass the ring so
+# those slots are not overwritten.
+class PreRollRing:
+    def __init__(self, capacity: int, size_xy):
+        w, h = size_xy
+        self.size = (w, h)
+        self._ring = np.empty((int(capacity), h * 3 // 2, w), np.uint8)
+        self._idx = 0
+        self._filled = 0
+        self._holds = 0
+        self._lock = Lock()
+
+    def push(self, yuv_frame):
+        if self._holds:
+            return yuv_frame.copy()
+        slot = self._ring[self._idx]
+        np.copyto(slot, yuv_frame)
+        self._idx = (self._idx + 1) % len(self._ring)
+        self._filled = min(len(self._ring), self._filled + 1)
+        return slot
+
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+        cap = len(self._ring)
+        start = (self._idx - self._filled) % cap
+        return [self._ring[(start + k) % cap] for k in range(self._filled)]
+
+    def release(self):
+        with self._lock:
+            self._holds = max(0, self._holds - 1)
+
+
 # Recognized signal (called from main/fingerprint)
-_recognized_signal = {"pending": False, "user_id": None, "lock": Lock()}
+_recognized_signal = queue.SimpleQueue()
 
 
 def mark_recognized_event(user_id: int):
-    with _recognized_signal["lock"]:
-        _recognized_signal["pending"] = True
-        _recognized_signal["user_id"] = int(user_id)
+    _recognized_signal.put(int(user_id))
 
 
 # backward-compat
@@ -150,19 +298,7 @@ def notify_recognized_event(user_id: int):
     return mark_recognized_event(user_id)
 
 
-# compatibility with typo in older main
-def notify_recoadgnized_event(user_id: int):
-    return mark_recognized_event(user_id)
-
-
 # Helpers
-def _ensure_size(bgr, size_xy):
-    w, h = size_xy
-    if bgr.shape[1] == w and bgr.shape[0] == h:
-        return bgr
-    return cv2.resize(bgr, (w, h), interpolation=cv2.INTER_AREA)
-
-
 def _load_haar(paths):
     for p in paths:
         if os.path.exists(p):
@@ -172,7 +308,12 @@ def _load_haar(paths):
     return None
 
 
+# live face gate: LBP cascade when installed (integer features, a few times faster
+# than Haar), Haar otherwise
 HAAR_FACE = _load_haar([
+    "/home/student/lbpcascade_frontalface_improved.xml",
+    "/usr/share/opencv4/lbpcascades/lbpcascade_frontalface_improved.xml",
+    "/usr/share/opencv/lbpcascades/lbpcascade_frontalface_improved.xml",
     "/home/student/haarcascade_frontalface_default.xml",
     "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml",
     "/usr/share/opencv/haarcascades/haarcascade_frontalface_default.xml",
@@ -184,9 +325,47 @@ HAAR_UPPER = _load_haar([
 ])
 
 
+# MobileNet-SSD person detector (optional; without it HOG + Haar are used)
+def _load_ssd(candidates):
+    for proto, model in candidates:
+        if os.path.exists(proto) and os.path.exists(model):
+            try:
+                net = cv2.dnn.readNetFromCaffe(proto, model)
+            except cv2.error:
+                continue
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            return net
+    return None
+
+
+PERSON_SSD = _load_ssd([
+    ("models/MobileNetSSD_deploy.prototxt", "models/MobileNetSSD_deploy.caffemodel"),
+    ("/home/student/MobileNetSSD_deploy.prototxt", "/home/student/MobileNetSSD_deploy.caffemodel"),
+])
+
+
+def _ssd_has_human(bgr_small) -> bool:
+    blob = cv2.dnn.blobFromImage(bgr_small, SSD_SCALE, SSD_INPUT_SIZE, SSD_MEAN)
+    PERSON_SSD.setInput(blob)
+    det = PERSON_SSD.forward()[0, 0]
+    return bool(((det[:, 1] == SSD_PERSON_CLASS) & (det[:, 2] > SSD_CONFIDENCE)).any())
+
+
+# MOG_SIZE blob box (x, y, w, h) -> padded crop of the LORES_SIZE gray frame
+def _motion_roi(gray, box):
+    x, y, w, h = (int(v) * MOG_DOWNSCALE for v in box)
+    H, W = gray.shape[:2]
+    x0, y0 = max(0, x - MOTION_ROI_PAD), max(0, y - MOTION_ROI_PAD)
+    x1, y1 = min(W, x + w + MOTION_ROI_PAD), min(H, y + h + MOTION_ROI_PAD)
+    return gray[y0:y1, x0:x1]
+
+
+# Cascades as the HOG fallback's second opinion: the face first, the slower
+# upper-body cascade only when it misses (people not facing the camera)
 def _haar_has_human(gray_small) -> bool:
     if HAAR_FACE is not None:
-        faces = HAAR_FACE.detectMultiScale(gray_small, 1.1, 2, minSize=(20, 20))
+        faces = HAAR_FACE.detectMultiScale(gray_small, 1.1, 2, minSize=FACE_MIN_SIZE, maxSize=FACE_MAX_SIZE)
         if len(faces) > 0:
             return True
     if HAAR_UPPER is not None:
@@ -196,28 +375,309 @@ def _haar_has_human(gray_small) -> bool:
     return False
 
 
+# Fixed HOG windows (x, y, w, h) with the 1:2 people aspect: full-height and
+# two-thirds-height columns, half-window horizontal step, top and bottom aligned.
+def _hog_rois(w, h):
+    rois = []
+    for scale in HOG_ROI_SCALES:
+        rh = int(h * scale)
+        rw = rh // 2
+        for y in sorted({0, h - rh}):
+            for x in range(0, w - rw + 1, max(1, rw // 2)):
+                rois.append((x, y, rw, rh))
+    return rois
+
+
+def _host(m):
+    return m.get() if isinstance(m, cv2.UMat) else m
+
+
+# Background detector: motion (MOG2) + person check off the capture thread.
+# submit() drops the newest I420 ring frame into a one-slot queue (an unprocessed
+# older frame is replaced); its Y plane feeds motion and HOG, and it is converted
+# to colour only for the SSD. result() returns the latest (motion, human, ts).
+class DetectorThread:
+    def __init__(self):
+        # MOG2 for motion (on downscaled frame)
+        self.mog = cv2.createBackgroundSubtractorMOG2(
+            history=MOG_HISTORY, varThreshold=MOG_VARTHRESH, detectShadows=False
+        )
+        # People detector: one SSD forward pass, or HOG when no model is installed
+        self.hog = None
+        if PERSON_SSD is None:
+            self.hog = cv2.HOGDescriptor()
+            sv = cv2.HOGDescriptor_getDefaultPeopleDetector()
+            self.hog.setSVMDetector(sv)  # detectMultiScale in _hog_confirm needs it
+            sv = sv.ravel()
+            self.hog_w, self.hog_b = sv[:-1], float(sv[-1])
+            self.hog_rois = _hog_rois(*RING_SIZE)
+        self.hog_counter = 0
+        self.motion_streak = 0
+        self.prev_small = None
+        self.diff_streak = 0
+        self.activity = 0.0  # EMA of the changed-pixel count; read by the capture loop
+
+        self.q = queue.Queue(maxsize=1)
+        self.lock = Lock()
+        self._result = (False, False, 0.0)
+        self.stop_flag = threading.Event()
+        self.t = threading.Thread(target=self._run, daemon=True)
+        self.t.start()
+
+    @property
+    def name(self) -> str:
+        return "MobileNet-SSD" if self.hog is None else "HOG + Haar"
+
+    @property
+    def idle(self) -> bool:
+        return self.activity < ACTIVITY_IDLE
+
+    def submit(self, yuv, ts: float, detect=True, person_check=True):
+        item = (yuv, ts, detect, person_check)
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            # latest wins
+            try:
+                self.q.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.q.put_nowait(item)
+            except queue.Full:
+                pass
+
+    def result(self):
+        with self.lock:
+            return self._result
+
+    def _run(self):
+        while not self.stop_flag.is_set():
+            try:
+                item = self.q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is None:  # shutdown signal
+                break
+            try:
+                self._process(*item)
+            except Exception as e:
+                log_event(f"Detector error: {e}", "C")
+
+    def _process(self, yuv, ts, detect, person_check):
+        # motion runs on the Y plane downscaled to MOG_SIZE: few pixels to difference/model
+        y_plane = yuv[:RING_SIZE[1]]
+        src = cv2.UMat(y_plane) if USE_OPENCL else y_plane
+        small = cv2.resize(src, MOG_SIZE, interpolation=cv2.INTER_AREA)
+        prev, self.prev_small = self.prev_small, small
+        if not detect:
+            self.diff_streak = 0
+            self.mog.apply(small)
+            return  # background-model refresh only
+
+        # cheap u8 frame difference gates the mask filtering and person checks;
+        # MOG2 itself is updated on every detection frame
+        changed = 0
+        if prev is not None:
+            _, mask = cv2.threshold(cv2.absdiff(small, prev), DIFF_THRESH, 255, cv2.THRESH_BINARY)
+            changed = cv2.countNonZero(cv2.dilate(mask, None))
+        self.activity += ACTIVITY_ALPHA * (changed - self.activity)
+        self.diff_streak = self.diff_streak + 1 if changed > MOG_MIN_AREA else 0
+        if self.diff_streak < DIFF_CONFIRM_N:
+            # quiet: keep the background model fresh (idle frames already arrive
+            # at 1/MOG_IDLE_EVERY_N of the frame rate)
+            self.mog.apply(small)
+            self.motion_streak = 0
+            with self.lock:
+                self._result = (False, False, ts)
+            return
+
+        # sustained difference: MOG2 confirms foreground blobs
+        fg = self.mog.apply(small)
+        fg = _host(cv2.morphologyEx(fg, cv2.MORPH_OPEN, MOTION_KERNEL))
+        motion = False
+        box = None  # largest blob's bounding box (stats columns x, y, w, h)
+        if cv2.countNonZero(fg) > MOG_MIN_AREA:  # no blob can pass when the whole mask is smaller
+            n, _, stats, _ = cv2.connectedComponentsWithStats(fg, connectivity=8)
+            if n > 1:
+                areas = stats[1:, cv2.CC_STAT_AREA]
+                big = int(areas.argmax())
+                motion = bool(areas[big] > MOG_MIN_AREA)
+                box = stats[1 + big, :4]
+        self.motion_streak = self.motion_streak + 1 if motion else 0
+
+        # person check periodically
+        self.hog_counter = (self.hog_counter + 1) % HOG_EVERY_N
+        human = False
+        if motion and self.hog_counter == 0 and person_check:
+            if self.hog is None:
+                human = _ssd_has_human(_ring_to_main(yuv))
+            else:
+                human = self._hog_has_human(y_plane)
+                if not human:
+                    gray = cv2.resize(y_plane, LORES_SIZE, interpolation=cv2.INTER_AREA)
+                    if self.motion_streak >= HOG_CONFIRM_N:
+                        # persistent motion the fixed windows miss: one pyramid pass
+                        self.motion_streak = 0
+                        human = self._hog_confirm(gray)
+                    if not human and (HAAR_FACE is not None or HAAR_UPPER is not None):
+                        human = _haar_has_human(_motion_roi(gray, box))
+
+        with self.lock:
+            self._result = (motion, human, ts)
+
+    def _hog_has_human(self, gray) -> bool:
+        # one HOG descriptor per fixed window + linear SVM, no multi-scale pyramid;
+        # single-channel input: one gradient pass instead of three
+        feats = np.stack([
+            self.hog.compute(cv2.resize(gray[y:y + h, x:x + w], HOG_WINDOW, interpolation=cv2.INTER_AREA)).ravel()
+            for x, y, w, h in self.hog_rois
+        ])
+        return bool(((feats @ self.hog_w) + self.hog_b > 0).any())
+
+    def _hog_confirm(self, gray) -> bool:
+        rects, _ = self.hog.detectMultiScale(gray, winStride=HOG_CONFIRM_STRIDE, padding=(0, 0),
+                                             scale=HOG_CONFIRM_SCALE)
+        return len(rects) > 0
+
+    def close(self):
+        if not self.stop_flag.is_set():
+            self.stop_flag.set()
+            try:
+                self.q.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.q.put_nowait(None)
+            except queue.Full:
+                pass
+        self.t.join(timeout=2.0)
+
+
+# Recognized clip post-processing (off the capture thread): finish encoding,
+# score the clip, then keep it (tmp -> final + progress) or drop it. The worker is a
+# daemon and a running scorer child is killed at exit, so a pending clip never holds
+# up shutdown (its tmp file is left behind).
+_postproc_q = queue.SimpleQueue()
+_scorer = None  # running scoring subprocess
+
+
+def _postproc_worker():
+    while True:
+        _finalize_recognized(*_postproc_q.get())
+
+
+@atexit.register
+def _kill_scorer():
+    p = _scorer
+    if p is not None and p.poll() is None:
+        p.kill()
+
+
+def _score_clip(path):
+    # this process stays at cv2.setNumThreads(1) for the live loop; the child uses
+    # every core. In-process scoring is the fallback if the child fails.
+    global _scorer
+    try:
+        with subprocess.Popen(
+            [sys.executable, "-m", "camera.video_quality", os.path.abspath(path)],
+            cwd=PKG_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        ) as p:
+            _scorer = p
+            try:
+                out, err = p.communicate(timeout=SCORE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                raise
+            finally:
+                _scorer = None
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, p.args, out, err)
+        r = json.loads(out)
+        return r["score"], r["details"]
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError) as e:
+        log_event(f"Scoring subprocess failed ({e}), scoring in-process", "C")
+        return score_video(path)
+
+
+def _finalize_recognized(writer, tmp_path, uid):
+    if writer:
+        try:
+            writer.close()
+            writer.t.join()  # the clip must be complete before it is scored
+        except Exception:
+            pass
+    # Quality post-processing (only if we have tmp and uid)
+    if not tmp_path or uid is None:
+        return
+    try:
+        score, details = _score_clip(tmp_path)
+        goal, minq = get_policy()
+        if score >= minq:
+            # rename tmp -> final (visible in recognized/)
+            final_path = _recognized_path(uid)
+            try:
+                os.replace(tmp_path, final_path)
+            except Exception:
+                shutil.copy2(tmp_path, final_path)
+                try: os.remove(tmp_path)
+                except Exception: pass
+            # record progress
+            record_accepted_clip(uid, final_path, score, details)
+            log_event(f"RECOGNIZED saved (q={score:.3f}) -> {final_path}", "C")
+        else:
+            # poor recording - remove temporary file
+            try: os.remove(tmp_path)
+            except Exception: pass
+            log_event(f"RECOGNIZED dropped (q={score:.3f})", "C")
+    except Exception as e:
+        log_event(f"RECOGNIZED post-process error: {e}", "C")
+
+
+threading.Thread(target=_postproc_worker, name="postproc", daemon=True).start()
+
+
 # Main loop (preview + recording)
 def start_camera_recording():
     global _latest_frame
 
-    # Picamera2 setup: preview (lower resolution for CPU) 
+    # Picamera2 setup: main stream (BGR888, written as is; no per-frame cvtColor)
+    # + ISP-scaled RING_SIZE lores stream (I420, converted with RING_TO_MAIN)
+    # that is the pre-roll frame as is and whose Y plane feeds detection (no CPU
+    # resize on the capture thread)
     picam2 = Picamera2()
-    picam2.preview_configuration.main.size = MAIN_SIZE
-    picam2.preview_configuration.main.format = "RGB888"
-    picam2.configure("preview")
-    picam2.start()
-
-    # MOG2 for motion (on downscaled frame)
-    mog = cv2.createBackgroundSubtractorMOG2(
-        history=MOG_HISTORY, varThreshold=MOG_VARTHRESH, detectShadows=False
+    config = picam2.create_video_configuration(
+        main={"size": MAIN_SIZE, "format": "BGR888"},
+        lores={"size": RING_SIZE, "format": "YUV420"},
+        display=None,
+        buffer_count=CAMERA_BUFFERS,
+        # sensor paced at FPS: capture_request blocks one frame period, no sleep needed
+        controls={"FrameDurationLimits": (FRAME_US, FRAME_US)},
     )
+    picam2.align_configuration(config)
+    picam2.configure(config)
+    main = picam2.camera_configuration()["main"]
+    # writers take MAIN_SIZE 3-channel frames straight from the main buffer
+    if tuple(main["size"]) != MAIN_SIZE or main["format"] != "BGR888":
+        log_event(f"Camera error: main stream is not BGR888 at {MAIN_SIZE}: {main}", "C")
+        picam2.close()
+        return
+    lores = picam2.camera_configuration()["lores"]
+    # ring / detector / GUI treat lores as packed I420 at RING_SIZE (no row padding)
+    if tuple(lores["size"]) != RING_SIZE or lores["stride"] != RING_SIZE[0]:
+        log_event(f"Camera error: lores stream is not packed I420 at {RING_SIZE}: {lores}", "C")
+        picam2.close()
+        return
+    picam2.start()
+    log_event(f"Camera main stream: {main}", "C")
+    log_event(f"Camera lores stream: {lores}", "C")
 
-    # HOG people-detector
-    hog = cv2.HOGDescriptor()
-    hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    # motion + person detection on its own thread
+    detector = DetectorThread()
+    log_event(f"Person detector: {detector.name}", "C")
 
-    # ring buffer for pre-roll
-    pre_frames = deque(maxlen=int(RECOG_PRE_SEC * FPS))
+    # ring buffer for pre-roll (I420 lores frames)
+    pre_roll = PreRollRing(int(RECOG_PRE_SEC * FPS), RING_SIZE)
 
     # recording state
     recognized_writer = None
@@ -230,95 +690,119 @@ def start_camera_recording():
     unrec_writer = None
     human_active = False
     last_human_ts = 0.0
-    hog_counter = 0
+    det_seen_ts = 0.0
+    mog_counter = 0
+
+    # hot-loop bindings (skip per-frame attribute lookups)
+    _capture_request = picam2.capture_request
+    _ring_push = pre_roll.push
+    _det_submit = detector.submit
+    _det_result = detector.result
+    _time = time.time
 
     _set_status("Not Recording")
     log_event("Camera started (preview + recording)", "C")
 
     try:
         while True:
-            # recognized signal?
-            with _recognized_signal["lock"]:
-                if _recognized_signal["pending"]:
-                    _recognized_signal["pending"] = False
-                    uid = _recognized_signal["user_id"]
-                    _recognized_signal["user_id"] = None
-
-                    # stop unrecognized if running
-                    if unrec_writer is not None:
-                        try:
-                            unrec_writer.close()
-                        except Exception:
-                            pass
-                        unrec_writer = None
-                        human_active = False
-                        log_event("UNRECOGNIZED stopped (recognized override)", "C")
-
-                    # start recognized
+            # recognized signal? (if several arrived since the last frame, the latest wins)
+            uid = None
+            while True:
+                try:
+                    uid = _recognized_signal.get_nowait()
+                except queue.Empty:
+                    break
+            if uid is not None:
+                # stop unrecognized if running
+                if unrec_writer is not None:
                     try:
-                        if not should_collect(uid):
-                            log_event(f"RECOGNIZED skipped: user {uid} dataset ready", "C")
-                            recognized_writer = None
-                            recognized_active = False
-                            recognized_until = 0.0
-                            _set_status("Not Recording")
-                        else:
-                            tmp_path = _recognized_tmp_path(uid)   # temporary file
-                            recognized_writer = VideoWriterThread(tmp_path, frame_size=MAIN_SIZE, fps=FPS)
-                            for rf in pre_frames:
-                                recognized_writer.push(_ensure_size(rf, MAIN_SIZE))
-                            recognized_active = True
-                            recognized_until = time.time() + RECOG_POST_SEC
-                            recognized_last_tmp = tmp_path
-                            recognized_uid = uid
-                            _set_status("Recording")
-                            log_event(f"RECOGNIZED start (tmp): {tmp_path}", "C")
-                    except Exception as e:
-                        log_event(f"RECOGNIZED start fail: {e}", "C")
+                        unrec_writer.close()
+                    except Exception:
+                        pass
+                    unrec_writer = None
+                    human_active = False
+                    log_event("UNRECOGNIZED stopped (recognized override)", "C")
+
+                # start recognized
+                try:
+                    if not should_collect(uid):
+                        log_event(f"RECOGNIZED skipped: user {uid} dataset ready", "C")
                         recognized_writer = None
                         recognized_active = False
-                        recognized_last_tmp = None
-                        recognized_uid = None
-
-            # Capture one frame (RGB -> BGR)
-            frame_rgb = picam2.capture_array()
-            frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
-
-            # GUI preview (store copy)
-            with frame_lock:
-                _latest_frame = frame_bgr.copy()
+                        recognized_until = 0.0
+                        _set_status("Not Recording")
+                    else:
+                        tmp_path = _recognized_tmp_path(uid)   # temporary file
+                        recognized_writer = VideoWriterThread(
+                            tmp_path, frame_size=MAIN_SIZE, fps=FPS,
+                            buffers=RECOG_WRITER_BUFFERS,
+                            preroll=pre_roll.hold(), preroll_done=pre_roll.release,
+                        )
+                        recognized_active = True
+                        recognized_until = _time() + RECOG_POST_SEC
+                        recognized_last_tmp = tmp_path
+                        recognized_uid = uid
+                        _set_status("Recording")
+                        log_event(f"RECOGNIZED start (tmp, {recognized_writer.encoder}): {tmp_path}", "C")
+                except Exception as e:
+                    log_event(f"RECOGNIZED start fail: {e}", "C")
+                    recognized_writer = None
+                    recognized_active = False
+                    recognized_last_tmp = None
+                    recognized_uid = None
 
-            # pre-roll: keep RING_SIZE frame 
-            if frame_bgr.shape[:2] != (RING_SIZE[1], RING_SIZE[0]):
-                ring_frame = cv2.resize(frame_bgr, RING_SIZE, interpolation=cv2.INTER_AREA)
-            else:
-                ring_frame = frame_bgr
-            pre_frames.append(ring_frame)
+            # Capture one request and view both streams in place (main: BGR888 at
+            # MAIN_SIZE; lores: I420 at RING_SIZE), no capture_array memcpy. The mapping
+            # only lives until the request is released, so the ring slot copy and the
+            # writer buffer copies run inside it.
+            req = _capture_request()
+            try:
+                with MappedArray(req, "main") as m_main, MappedArray(req, "lores") as m_lores:
+                    frame_bgr = m_main.array
 
-            # human motion detection (on low-res) 
-            lores = cv2.resize(frame_bgr, LORES_SIZE, interpolation=cv2.INTER_AREA)
-            gray = cv2.cvtColor(lores, cv2.COLOR_BGR2GRAY)
+                    # pre-roll: keep the RING_SIZE lores frame (copied into its ring slot)
+                    ring_frame = _ring_push(m_lores.array)
 
-            fg = mog.apply(gray)
-            fg = cv2.medianBlur(fg, 5)
-            contours, _ = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            motion = any(cv2.contourArea(c) > MOTION_MIN_AREA for c in contours)
+                    # record every frame while a clip is open (unrecognized incl. tail,
+                    # recognized post-roll); writers copy into their own buffers
+                    if unrec_writer:
+                        unrec_writer.push(frame_bgr)
+                    if recognized_writer:
+                        recognized_writer.push(frame_bgr)
+            finally:
+                req.release()
 
-            # HOG periodically + Haar fallback
-            hog_counter = (hog_counter + 1) % HOG_EVERY_N
+            # GUI preview: publish the ring frame (owned memory, not the camera buffer;
+            # its slot is not reused for RECOG_PRE_SEC and the reader copies it)
+            with frame_lock:
+                _latest_frame = ring_frame
+
+            # human motion detection (on the ring frame, on the detector thread).
+            # Detection only runs while it can change recording state: not during a
+            # recognized clip (MOG2 is still fed every few frames to keep its background
+            # current), and no person check while a fresh unrecognized tail runs. While
+            # the scene is idle only every MOG_IDLE_EVERY_N-th frame is examined.
+            now = _time()
+            detect_needed = not recognized_active
+            mog_counter = (mog_counter + 1) % MOG_IDLE_EVERY_N
+            if mog_counter == 0 or (detect_needed and not detector.idle):
+                tail_fresh = human_active and (now - last_human_ts) < UNREC_TAIL_SEC - 1
+                _det_submit(ring_frame, now, detect=detect_needed,
+                            person_check=not tail_fresh)
+
+            # act on each detector result once
+            motion = False
             human = False
-            if motion and hog_counter == 0:
-                rects, _ = hog.detectMultiScale(
-                    lores, winStride=HOG_WIN_STRIDE, padding=(8, 8), scale=1.05
-                )
-                human = len(rects) > 0
-                if not human and (HAAR_FACE is not None or HAAR_UPPER is not None):
-                    human = _haar_has_human(gray)
-
-            # Unrecognized recording (only when recognized is NOT active) 
+            if detect_needed:
+                d_motion, d_human, d_ts = _det_result()
+                if d_ts > det_seen_ts:
+                    det_seen_ts = d_ts
+                    motion, human = d_motion, d_human
+
+            # Unrecognized recording (only when recognized is NOT active)
             if not recognized_active:
                 if motion and human:
-                    last_human_ts = time.time()
+                    last_human_ts = det_seen_ts
                     if not human_active:
                         human_active = True
                         try:
@@ -327,75 +811,42 @@ def start_camera_recording():
                                 path, frame_size=MAIN_SIZE, fps=FPS
                             )
                             _set_status("Recording")
-                            log_event(f"UNRECOGNIZED start: {path}", "C")
+                            log_event(f"UNRECOGNIZED start ({unrec_writer.encoder}): {path}", "C")
                         except Exception as e:
                             log_event(f"UNRECOGNIZED start fail: {e}", "C")
                             unrec_writer = None
                             human_active = False
+                elif human_active and (now - last_human_ts) >= UNREC_TAIL_SEC:
+                    human_active = False
                     if unrec_writer:
-                        unrec_writer.push(_ensure_size(frame_bgr, MAIN_SIZE))
-                else:
-                    if human_active and (time.time() - last_human_ts) >= UNREC_TAIL_SEC:
-                        human_active = False
-                        if unrec_writer:
-                            try:
-                                unrec_writer.close()
-                            except Exception:
-                                pass
-                            unrec_writer = None
-                        _set_status("Not Recording")
-                        log_event("UNRECOGNIZED stop (timeout)", "C")
-
-            # Recognized post recording 
-            if recognized_active:
-                if recognized_writer:
-                    recognized_writer.push(_ensure_size(frame_bgr, MAIN_SIZE))
-                if time.time() >= recognized_until:
-                    recognized_active = False
-                    if recognized_writer:
                         try:
-                            recognized_writer.close()
+                            unrec_writer.close()
                         except Exception:
                             pass
-                        recognized_writer = None
+                        unrec_writer = None
                     _set_status("Not Recording")
-                    log_event("RECOGNIZED stop", "C")
-                    # Quality post-processing (only if we have tmp and uid)
-                    if recognized_last_tmp and recognized_uid is not None:
-                        try:
-                            score, details = score_video(recognized_last_tmp)
-                            goal, minq = get_policy()
-                            if score >= minq:
-                                # rename tmp -> final (visible in recognized/)
-                                final_path = _recognized_path(recognized_uid)
-                                try:
-                                    os.replace(recognized_last_tmp, final_path)
-                                except Exception:
-                                    import shutil
-                                    shutil.copy2(recognized_last_tmp, final_path)
-                                    try: os.remove(recognized_last_tmp)
-                                    except Exception: pass
-                                # record progress
-                                record_accepted_clip(recognized_uid, final_path, score, details)
-                                log_event(f"RECOGNIZED saved (q={score:.3f}) -> {final_path}", "C")
-                            else:
-                                # poor recording - remove temporary file
-                                try: os.remove(recognized_last_tmp)
-                                except Exception: pass
-                                log_event(f"RECOGNIZED dropped (q={score:.3f})", "C")
-                        except Exception as e:
-                            log_event(f"RECOGNIZED post-process error: {e}", "C")
-
-                    recognized_last_tmp = None
-                    recognized_uid = None
+                    log_event("UNRECOGNIZED stop (timeout)", "C")
 
-            # pace ~ FPS
-            time.sleep(max(0.0, (1.0 / FPS) - 0.001))
+            # Recognized post recording 
+            if recognized_active and now >= recognized_until:
+                recognized_active = False
+                _set_status("Not Recording")
+                log_event("RECOGNIZED stop", "C")
+                # close + quality post-processing run on the post-processing worker
+                if recognized_writer or recognized_last_tmp:
+                    _postproc_q.put((recognized_writer, recognized_last_tmp, recognized_uid))
+                recognized_writer = None
+                recognized_last_tmp = None
+                recognized_uid = None
 
     except Exception as e:
         log_event(f"Camera error: {e}", "C")
         _set_status("Not Recording")
     finally:
+        try:
+            detector.close()
+        except Exception:
+            pass
         try:
             if recognized_writer:
                 recognized_writer.close()
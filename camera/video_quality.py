@@ -17,23 +17,27 @@ HAAR_FACE = _load_haar([
     "/usr/share/opencv/haarcascades/haarcascade_frontalface_default.xml",
 ])
 
-def _brightness_score(gray):
-    m = gray.mean() / 255.0
+def _brightness_score(mean):
+    m = mean / 255.0
     if 0.35 <= m <= 0.75:
         return 1.0
     if m < 0.35:
         return max(0.0, (m - 0.15) / (0.35 - 0.15))
     return max(0.0, (0.95 - m) / (0.95 - 0.75))
 
-def _sharpness_score(gray):
-    val = cv2.Laplacian(gray, cv2.CV_64F).var()
-    raw = val / 200.0
+def _sharpness_score(lap_var):
+    raw = lap_var / 200.0
     return float(np.clip(0.85 * np.tanh(raw) + 0.15 * np.clip(raw, 0.0, 1.0), 0.0, 1.0))
 
-def _face_score(frame):
+# Frame mean + Laplacian variance: int16 Laplacian (fits 8*255), OpenCV reductions
+def _bs_scores(gray):
+    mean = cv2.mean(gray)[0]
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+    return _brightness_score(mean), _sharpness_score(float(std[0, 0]) ** 2)
+
+def _face_score(gray):
     if HAAR_FACE is None:
         return 0.0
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     faces = HAAR_FACE.detectMultiScale(gray, 1.1, 3, minSize=(60, 60))
     if len(faces) == 0:
         return 0.0
@@ -66,26 +70,45 @@ def score_video(path, max_frames=120):
     n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
     step = max(1, n // max_frames)
 
-    b, s, f = [], [], []
-    idx = 0
+    # per-sample scores (brightness, sharpness, face) + reused resize/gray buffers
+    scores = np.empty((3, -(-n // step) + 1), np.float32)
+    frm = np.empty((360, 640, 3), np.uint8)
+    gray = np.empty((360, 640), np.uint8)
+    k = 0
     ok, frame = cap.read()
     while ok:
-        if idx % step == 0:
-            frm = cv2.resize(frame, (640, 360), interpolation=cv2.INTER_AREA)
-            gray = cv2.cvtColor(frm, cv2.COLOR_BGR2GRAY)
-            b.append(_brightness_score(gray))
-            s.append(_sharpness_score(gray))
-            f.append(_face_score(frm))
-        idx += 1
+        if k == scores.shape[1]:
+            # frame count is only a hint (0 or short on some containers): grow
+            scores = np.concatenate((scores, np.empty_like(scores)), axis=1)
+        cv2.resize(frame, (640, 360), dst=frm, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(frm, cv2.COLOR_BGR2GRAY, dst=gray)
+        scores[:2, k] = _bs_scores(gray)
+        scores[2, k] = _face_score(gray)
+        k += 1
+        # step over the frames between samples with grab(): no retrieve/BGR copy
+        for _ in range(step - 1):
+            if not cap.grab():
+                break
         ok, frame = cap.read()
     cap.release()
 
-    if not b:
+    if not k:
         return 0.0, {"error": "empty"}
 
+    b, s, f = scores[:, :k]
     B = float(np.median(b))
     S = float(np.median(s))
-    F = float(np.percentile(np.array(f), 90)) if f else 0.0  # more stable than max
+    F = float(np.percentile(f, 90))  # more stable than max
 
     score = 0.25 * B + 0.25 * S + 0.50 * F
     return float(np.clip(score, 0.0, 1.0)), {"brightness": B, "sharpness": S, "face": F}
+
+
+# Standalone scorer (used by the camera post-processing): a fresh process keeps
+# OpenCV's default all-core thread pool; niced so it yields to live capture
+if __name__ == "__main__":
+    import json
+    import sys
+    os.nice(10)
+    score, details = score_video(sys.argv[1])
+    print(json.dumps({"score": score, "details": details}))
@@ -7,8 +7,10 @@ import hmac
 import secrets
 import fcntl
 import time
+import atexit
+import threading
 from pathlib import Path
-from typing import Optional, Set, Dict, Callable
+from typing import Optional, Set, FrozenSet, Dict, Callable
 
 # Paths 
 BASE_DIR = Path(".")
@@ -34,21 +36,75 @@ def _ensure_file_secure(p: Path) -> None:
     try: os.chmod(p, 0o600)
     except PermissionError: pass
 
+# Append journal: one long-lived O_APPEND fd per file (opened + chmod'ed once).
+# A write is visible to readers immediately; fsync is batched by a background
+# thread every APPEND_SYNC_SEC and once more at exit.
+APPEND_SYNC_SEC = 0.5
+_append_lock = threading.Lock()
+_append_fds: Dict[Path, int] = {}
+_append_dirty: Set[int] = set()
+_append_syncer: Optional[threading.Thread] = None
+
+def _append_fd(p: Path) -> int:
+    fd = _append_fds.get(p)
+    if fd is None:
+        _ensure_dir_secure(p.parent)
+        fd = os.open(str(p), os.O_CREAT | os.O_APPEND | os.O_WRONLY, 0o600)
+        _ensure_file_secure(p)
+        _append_fds[p] = fd
+    return fd
+
+def _sync_appends() -> None:
+    with _append_lock:
+        dirty = list(_append_dirty)
+        _append_dirty.clear()
+    for fd in dirty:
+        try: os.fsync(fd)
+        except OSError: pass
+
+def _append_sync_loop() -> None:
+    while True:
+        time.sleep(APPEND_SYNC_SEC)
+        _sync_appends()
+
 def _atomic_append(p: Path, line: str) -> None:
-    _ensure_dir_secure(p.parent)
-    fd = os.open(str(p), os.O_CREAT | os.O_APPEND | os.O_WRONLY, 0o600)
-    f = os.fdopen(fd, "a", buffering=1)
+    global _append_syncer
+    data = line.encode()
+    _parsed_cache.pop(p, None)
+    with _append_lock:
+        fd = _append_fd(p)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            os.write(fd, data)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        _append_dirty.add(fd)
+        if _append_syncer is None:
+            _append_syncer = threading.Thread(target=_append_sync_loop, daemon=True)
+            _append_syncer.start()
+
+atexit.register(_sync_appends)
+
+# Parsed views of the data files, keyed by path and valid while the file's
+# (mtime, size) is unchanged; this process's own writes drop the entry outright.
+_parsed_cache: Dict[Path, tuple] = {}
+
+def _cached_parse(p: Path, parse: Callable):
     try:
-        fcntl.flock(f, fcntl.LOCK_EX)
-        f.write(line)
-        f.flush()
-        os.fsync(f.fileno())
-    finally:
-        fcntl.flock(f, fcntl.LOCK_UN)
-        f.close()
-    _ensure_file_secure(p)
+        st = p.stat()
+    except FileNotFoundError:
+        return parse(())
+    key = (st.st_mtime_ns, st.st_size)
+    hit = _parsed_cache.get(p)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    with open(p, "r") as f:
+        value = parse(f)
+    _parsed_cache[p] = (key, value)
+    return value
 
 def _locked_read_modify_write(p: Path, modifier: Callable[[list[str]], list[str]]) -> None:
+    _parsed_cache.pop(p, None)
     _ensure_dir_secure(p.parent)
     with open(p, "a+") as f:
         fcntl.flock(f, fcntl.LOCK_EX)
@@ -70,7 +126,14 @@ DEFAULT_CONFIG: Dict[str, object] = {
     "kdf_iters": 200_000,   # PBKDF2 iterations
 }
 
+# Parsed config cache, reloaded when the file's mtime changes (or after our own writes)
+_cfg_cache: Optional[dict] = None
+_cfg_mtime: Optional[int] = None
+_pepper_cache: bytes = b""
+
 def _write_cfg(cfg: dict) -> None:
+    global _cfg_cache
+    _cfg_cache = None
     with open(CONFIG_FILE, "w") as f:
         json.dump(cfg, f, indent=4)
     try: os.chmod(CONFIG_FILE, 0o600)
@@ -98,10 +161,23 @@ def ensure_config_exists() -> None:
         if changed:
             _write_cfg(cfg)
 
+def _cfg() -> dict:
+    global _cfg_cache, _cfg_mtime, _pepper_cache
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if _cfg_cache is None or mtime is None or mtime != _cfg_mtime:
+        ensure_config_exists()
+        with open(CONFIG_FILE, "r") as f:
+            cfg = json.load(f)
+        _pepper_cache = bytes.fromhex(cfg["pepper"])
+        _cfg_mtime = os.stat(CONFIG_FILE).st_mtime_ns
+        _cfg_cache = cfg
+    return _cfg_cache
+
 def load_config() -> dict:
-    ensure_config_exists()
-    with open(CONFIG_FILE, "r") as f:
-        return json.load(f)
+    return dict(_cfg())  # callers may modify their copy before save_config()
 
 def save_config(data: dict) -> None:
     ensure_config_exists()
@@ -112,14 +188,14 @@ def hash_password(password: str) -> str:
 
 # Crypto helpers 
 def _pepper_bytes() -> bytes:
-    cfg = load_config()
-    return bytes.fromhex(cfg["pepper"])  
+    _cfg()
+    return _pepper_cache
 
 def hmac_pin(pin: str) -> str:
     return hmac.new(_pepper_bytes(), pin.encode(), hashlib.sha256).hexdigest()
 
 def _pbkdf2_pin(pin: str, salt_hex: str) -> str:
-    cfg = load_config()
+    cfg = _cfg()
     salt = bytes.fromhex(salt_hex)
     dk = hashlib.pbkdf2_hmac(
         "sha256", pin.encode(), _pepper_bytes() + salt, int(cfg["kdf_iters"]), dklen=32
@@ -154,6 +230,8 @@ def generate_registration_pin() -> str:
 
 def consume_registration_pin(entered_pin: str) -> bool:
     token_hmac = hmac_pin(entered_pin).lower()
+    if token_hmac not in _read_hmac_tokens():
+        return False  # not a registration PIN: no locked rewrite of the file
 
     def _mod(lines: list[str]) -> list[str]:
         kept: list[str] = []
@@ -171,60 +249,79 @@ def consume_registration_pin(entered_pin: str) -> bool:
     _locked_read_modify_write(VALID_PINS_FILE, _mod)
     return bool(_mod.removed)  
 
-def _read_hmac_tokens() -> Set[str]:
+def _parse_hmac_tokens(lines) -> FrozenSet[str]:
     tokens: Set[str] = set()
-    if VALID_PINS_FILE.exists():
-        with open(VALID_PINS_FILE, "r") as f:
-            for line in f:
-                tok = line.strip().split("|", 1)[0]
-                if tok and len(tok) == 64 and all(c in "0123456789abcdefABCDEF" for c in tok):
-                    tokens.add(tok.lower())
-    return tokens
+    for line in lines:
+        tok = line.strip().split("|", 1)[0]
+        if tok and len(tok) == 64 and all(c in "0123456789abcdefABCDEF" for c in tok):
+            tokens.add(tok.lower())
+    return frozenset(tokens)
+
+def _read_hmac_tokens() -> FrozenSet[str]:
+    return _cached_parse(VALID_PINS_FILE, _parse_hmac_tokens)
 
 # User PINs (PBKDF2) 
+# Line: "p2:salt:hash|uid|ts|bucket". The bucket is a short HMAC prefix (256 buckets)
+# so a lookup only runs PBKDF2 on the few lines in the entered PIN's bucket; it is
+# kept short on purpose so it narrows, not reveals, the PIN. Lines written before
+# the bucket field existed are always checked.
+PIN_BUCKET_HEX = 2
+
+class PinTakenError(ValueError):
+    pass
+
+def _pin_bucket(raw_pin: str) -> str:
+    return hmac_pin(raw_pin)[:PIN_BUCKET_HEX]
+
+def _parse_pin_index(lines) -> Dict[Optional[str], list]:
+    # bucket -> split lines in it; lines without a bucket go under None
+    index: Dict[Optional[str], list] = {}
+    for line in lines:
+        parts = line.strip().split("|")
+        index.setdefault(parts[3] if len(parts) >= 4 else None, []).append(parts)
+    return index
+
+def _pin_candidates(raw_pin: str):
+    index = _cached_parse(PIN_TO_ID_FILE, _parse_pin_index)
+    yield from index.get(_pin_bucket(raw_pin), ())
+    yield from index.get(None, ())
+
 def is_user_pin_taken(raw_pin: str) -> bool:
-    if not PIN_TO_ID_FILE.exists():
-        return False
-    with open(PIN_TO_ID_FILE, "r") as f:
-        for line in f:
-            token = line.strip().split("|", 1)[0]
-            if token.startswith("p2:"):
-                try:
-                    _, salt_hex, hash_hex = token.split(":")
-                    if _pbkdf2_pin(raw_pin, salt_hex) == hash_hex:
-                        return True
-                except Exception:
-                    continue
+    for parts in _pin_candidates(raw_pin):
+        token = parts[0]
+        if token.startswith("p2:"):
+            try:
+                _, salt_hex, hash_hex = token.split(":")
+                if _pbkdf2_pin(raw_pin, salt_hex) == hash_hex:
+                    return True
+            except Exception:
+                continue
     return False
 
 def add_user_pin(user_id: int, raw_pin: str) -> None:
     if not (raw_pin.isdigit() and len(raw_pin) == 4):
         raise ValueError("PIN must be exactly 4 digits.")
     if is_user_pin_taken(raw_pin):
-        raise ValueError("That PIN is already taken. Choose a different one.")
+        raise PinTakenError("That PIN is already taken. Choose a different one.")
     salt_hex = secrets.token_hex(16)
     hash_hex = _pbkdf2_pin(raw_pin, salt_hex)
     token = f"p2:{salt_hex}:{hash_hex}"
-    _atomic_append(PIN_TO_ID_FILE, f"{token}|{int(user_id)}|{_now()}\n")
+    _atomic_append(PIN_TO_ID_FILE, f"{token}|{int(user_id)}|{_now()}|{_pin_bucket(raw_pin)}\n")
 
 def get_id_for_entered_pin(raw_pin: str) -> Optional[int]:
-    if not PIN_TO_ID_FILE.exists():
-        return None
-    with open(PIN_TO_ID_FILE, "r") as f:
-        for line in f:
-            parts = line.strip().split("|")
-            if len(parts) < 2:
-                continue
-            token, sid = parts[0], parts[1]
-            if not sid.isdigit():
+    for parts in _pin_candidates(raw_pin):
+        if len(parts) < 2:
+            continue
+        token, sid = parts[0], parts[1]
+        if not sid.isdigit():
+            continue
+        if token.startswith("p2:"):
+            try:
+                _, salt_hex, hash_hex = token.split(":")
+                if _pbkdf2_pin(raw_pin, salt_hex) == hash_hex:
+                    return int(sid)
+            except Exception:
                 continue
-            if token.startswith("p2:"):
-                try:
-                    _, salt_hex, hash_hex = token.split(":")
-                    if _pbkdf2_pin(raw_pin, salt_hex) == hash_hex:
-                        return int(sid)
-                except Exception:
-                    continue
     return None
 
 def remove_pins_for_id(user_id: int) -> int:
@@ -267,5 +364,14 @@ def ids_clear() -> None:
     _locked_read_modify_write(ID_TRACK_FILE, lambda _lines: [])
 
 # Utility 
+_clock_cache: Dict[str, tuple] = {}  # format -> (second, formatted local time); rebuilt once per second
+
+def local_time(fmt: str) -> str:
+    sec = int(time.time())
+    cached = _clock_cache.get(fmt)
+    if cached is None or cached[0] != sec:
+        cached = _clock_cache[fmt] = (sec, time.strftime(fmt, time.localtime(sec)))
+    return cached[1]
+
 def _now() -> str:
-    return time.strftime("%Y-%m-%dT%H:%M:%S")
+    return local_time("%Y-%m-%dT%H:%M:%S")
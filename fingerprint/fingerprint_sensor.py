@@ -1,6 +1,9 @@
 import asyncio
+import struct
+import threading
+import concurrent.futures
 import serial
-from typing import Callable, Iterable, Optional
+from typing import Callable, FrozenSet, Optional
 
 from adafruit_fingerprint import Adafruit_Fingerprint
 from lcd.lcd_controller import update_lcd
@@ -8,8 +11,8 @@ import camera.camera_module as camera_module
 
 # Centralized security and data storage lives in config_manager
 from config_manager import (
-    is_user_pin_taken,   # check whether a user PIN is already taken
     add_user_pin,        # store a user PIN (PBKDF2+salt+pepper)
+    PinTakenError,       # raised by add_user_pin when the PIN is already in use
     ids_list,            # read the list of IDs
     ids_add,             # add an ID
     ids_delete,          # delete a single ID
@@ -27,40 +30,214 @@ def set_logger(logger_func: Callable[[str, str], None]) -> None:
 
 # Status code definitions
 FINGERPRINT_OK = 0
+FINGERPRINT_PACKETRECIEVEERR = 1
 FINGERPRINT_NOFINGER = 2
 FINGERPRINT_NOTFOUND = 9
 
+# Sensor protocol bits used by the own packet parser / async image poll
+_GETIMAGE = 0x01
+_ACKPACKET = 0x07
+_STARTCODE = 0xEF01
+_GETIMAGE_REPLY_LEN = 12
+
+
+# Adafruit_Fingerprint with a leaner reply path: every ACK is read into one reusable
+# buffer, the header is unpacked in place and the checksum (which the library
+# skips) is verified. Raises RuntimeError like the library does.
+class _Fingerprint(Adafruit_Fingerprint):
+    def __init__(self, uart, *args):
+        self._rxbuf = bytearray(256)
+        super().__init__(uart, *args)
+
+    def _parse_packet(self, buf, n: int):
+        if n < 11:
+            raise RuntimeError("Failed to read data from sensor")
+        start, addr, packet_type, length = struct.unpack_from(">HIBH", buf, 0)
+        if start != _STARTCODE or packet_type != _ACKPACKET:
+            raise RuntimeError("Incorrect packet data")
+        if addr != int.from_bytes(bytes(self.address), "big"):
+            raise RuntimeError("Incorrect address")
+        end = 7 + length  # payload ends where the 2-byte checksum starts
+        if end + 2 > n:
+            raise RuntimeError("Incorrect packet data")
+        view = memoryview(buf)
+        if sum(view[6:end]) & 0xFFFF != struct.unpack_from(">H", buf, end)[0]:
+            raise RuntimeError("Packet checksum mismatch")
+        return list(view[9:end])
+
+    def _get_packet(self, expected: int):
+        view = memoryview(self._rxbuf)[:expected]
+        n = self._uart.readinto(view) or 0
+        if n != expected:
+            raise RuntimeError("Failed to read data from sensor")
+        return self._parse_packet(self._rxbuf, n)
+
+UART_REPLY_TIMEOUT = 1.0  # s, same as the serial read timeout
+
 # UART and sensor instance
 uart = serial.Serial("/dev/ttyAMA0", baudrate=57600, timeout=1)
-finger = Adafruit_Fingerprint(uart)
+try:
+    # ASYNC_LOW_LATENCY (TIOCSSERIAL): hand received bytes over without the tty's
+    # batching delay; best effort, not every UART driver supports it
+    uart.set_low_latency_mode(True)
+except (AttributeError, ValueError, OSError):
+    pass
+finger = _Fingerprint(uart)
 
 # Correctly set address and password
 finger.address = [0xFF, 0xFF, 0xFF, 0xFF]
 finger.password = [0x00, 0x00, 0x00, 0x01]
 
-# Working with the ID list (via config_manager)
-def load_used_ids() -> Iterable[int]:
-    return ids_list()
+# One sensor transaction at a time: the event loop's blocking sensor calls run on a
+# single worker thread, and every caller (worker, async GetImage, GUI thread) holds
+# _sensor_lock for the whole UART command/reply.
+_sensor_lock = threading.Lock()
+_sensor_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="fingerprint")
+
+
+def _locked(fn, *args):
+    with _sensor_lock:
+        return fn(*args)
+
+
+async def _s(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_sensor_pool, _locked, fn, *args)
+
+
+def _finger_search():
+    # match result together with the attributes it sets, read under the same lock
+    return finger.finger_search(), finger.finger_id, finger.confidence
+
+
+# Async GetImage: send the command, then wait on the UART fd in the event loop's
+# selector until the 12-byte ACK is in (finger.get_image() blocks the loop for the
+# whole image capture). Returns the confirmation code.
+async def _read_reply(n: int) -> bytearray:
+    loop = asyncio.get_running_loop()
+    fd = uart.fileno()
+    buf = bytearray()
+    done = loop.create_future()
+
+    def _on_readable() -> None:
+        k = uart.in_waiting
+        if k:
+            buf.extend(uart.read(k))
+        if len(buf) >= n and not done.done():
+            done.set_result(None)
+
+    loop.add_reader(fd, _on_readable)
+    try:
+        await asyncio.wait_for(done, UART_REPLY_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(fd)
+    return buf
+
+
+async def _get_image_async() -> int:
+    if not _sensor_lock.acquire(blocking=False):
+        return FINGERPRINT_PACKETRECIEVEERR  # UART busy (GUI operation): skip this poll
+    try:
+        if uart.in_waiting:
+            # leftovers (e.g. a late reply to a timed-out command) would misalign this reply
+            uart.reset_input_buffer()
+        finger._send_packet([_GETIMAGE])
+        res = await _read_reply(_GETIMAGE_REPLY_LEN)
+    finally:
+        _sensor_lock.release()
+    try:
+        return finger._parse_packet(res, min(len(res), _GETIMAGE_REPLY_LEN))[0]
+    except (RuntimeError, IndexError):
+        return FINGERPRINT_PACKETRECIEVEERR
+
+
+LIFT_POLL_SEC = 0.25  # lift detection is not latency critical
+
+
+# Wait until the finger is off the sensor, but at least `dwell` seconds; the lift is
+# polled during the dwell, so a finger lifted early ends it at `dwell` exactly.
+async def _wait_finger_lifted(dwell: float = 0.0) -> None:
+    loop = asyncio.get_running_loop()
+    until = loop.time() + dwell
+    while await _get_image_async() != FINGERPRINT_NOFINGER:
+        await asyncio.sleep(LIFT_POLL_SEC)
+    rest = until - loop.time()
+    if rest > 0:
+        await asyncio.sleep(rest)
+
+
+# Working with the ID list (via config_manager). An in-process frozenset mirrors the
+# file, plus a bitmap of it for the free-slot search; each change swaps in new
+# values, so GUI-thread writers and the event loop never see a partially updated set.
+# _ids_version is bumped on every change so readers can keep their own reference.
+SLOT_MASK = (1 << 127) - 2  # sensor slots 1..126
+_ids_cache: Optional[FrozenSet[int]] = None
+_ids_bitmap = 0
+_ids_version = 0
+
+
+def _set_ids_cache(ids: FrozenSet[int]) -> FrozenSet[int]:
+    global _ids_cache, _ids_bitmap, _ids_version
+    bitmap = 0
+    for i in ids:
+        bitmap |= 1 << i
+    _ids_bitmap = bitmap
+    _ids_cache = ids
+    _ids_version += 1
+    return ids
+
+
+def invalidate_ids_cache() -> None:
+    global _ids_cache, _ids_version
+    _ids_cache = None
+    _ids_version += 1
+
+
+def used_ids_version() -> int:
+    return _ids_version
+
+
+def load_used_ids() -> FrozenSet[int]:
+    ids = _ids_cache
+    if ids is None:
+        ids = _set_ids_cache(frozenset(ids_list()))
+    return ids
+
+
+def _free_slot() -> Optional[int]:
+    load_used_ids()
+    free = ~_ids_bitmap & SLOT_MASK
+    return (free & -free).bit_length() - 1 if free else None  # lowest free slot
 
 
 def save_used_id(new_id: int) -> None:
     ids_add(int(new_id))
+    _set_ids_cache(load_used_ids() | {int(new_id)})
 
 
-def delete_used_id(finger_id: int) -> None:
-    finger.delete_model(int(finger_id))
+def _forget_used_id(finger_id: int) -> None:
     ids_delete(int(finger_id))
+    _set_ids_cache(load_used_ids() - {int(finger_id)})
+
+
+def delete_used_id(finger_id: int) -> None:
+    _locked(finger.delete_model, int(finger_id))
+    _forget_used_id(finger_id)
 
 
 def clear_used_ids() -> None:
     ids_clear()
+    _set_ids_cache(frozenset())
 
 
 def delete_all_fingerprints() -> None:
-    if finger.verify_password():
+    with _sensor_lock:
+        if not finger.verify_password():
+            return
         finger.empty_library()
-        ids_clear()
-        log_event("All fingerprints removed from the sensor and the local ID list cleared", "F")
+    clear_used_ids()
+    log_event("All fingerprints removed from the sensor and the local ID list cleared", "F")
 
 
 # Registration state
@@ -70,10 +247,14 @@ _lock_input: Optional[Callable[[bool], None]] = None
 
 # PIN entry steps (local state)
 _pin_capture_active = False        # currently entering a PIN?
-_pin_capture_buffer = ""           # current entry
+_PIN_DIGITS = frozenset("0123456789")
+_pin_digits = 0                    # current entry packed as an int (buf*10 + digit)
+_pin_len = 0                       # number of digits entered (leading zeros count)
 _pin_capture_for_id: Optional[int] = None  # ID we are assigning the PIN to
 _pin_confirm_stage = 1             # 1 = first entry, 2 = confirmation
-_pin_first_entry = ""              # remembered first entry
+_pin_first = 0                     # remembered first entry (packed)
+_pin_done: Optional[asyncio.Event] = None  # set when PIN entry ends (stored or cancelled)
+_flash_handle: Optional[asyncio.TimerHandle] = None  # pending prompt redraw
 
 
 def set_reset_callback(func: Callable[[], None]) -> None:
@@ -87,18 +268,24 @@ def set_input_lock(lock_func: Callable[[bool], None]) -> None:
 
 
 def _pin_capture_reset() -> None:
-    global _pin_capture_active, _pin_capture_buffer, _pin_capture_for_id
-    global _pin_confirm_stage, _pin_first_entry
+    global _pin_capture_active, _pin_digits, _pin_len, _pin_capture_for_id
+    global _pin_confirm_stage, _pin_first, _flash_handle
+    if _flash_handle is not None:
+        _flash_handle.cancel()
+        _flash_handle = None
     _pin_capture_active = False
-    _pin_capture_buffer = ""
+    _pin_digits = 0
+    _pin_len = 0
     _pin_capture_for_id = None
     _pin_confirm_stage = 1
-    _pin_first_entry = ""
+    _pin_first = 0
 
 
 def cancel_registration() -> None:
     global register_mode
     register_mode = False
+    if _pin_done is not None:
+        _pin_done.set()  # wake a registration loop parked on PIN entry
     _pin_capture_reset()
     log_event("Registration cancelled", "F")
     update_lcd("Registration", "cancelled")
@@ -123,45 +310,56 @@ def is_registering() -> bool:
 
 # Main recognition loop
 async def fingerprint_loop() -> None:
+    # bind what the poll loop touches every 100 ms as locals; register_mode, the
+    # logger and the callbacks are reassigned from outside and stay global lookups
+    sleep = asyncio.sleep
+    get_image = _get_image_async
+    run = _s
+    image_2_tz = finger.image_2_tz
+    lcd = update_lcd
+    ok = FINGERPRINT_OK
+    notify = camera_module.notify_recognized_event
+    seen_version = -1
+    local_ids: FrozenSet[int] = frozenset()
+
     while True:
-        await asyncio.sleep(0.1)
+        await sleep(0.1)
 
         if register_mode:
             continue
 
-        if finger.get_image() != FINGERPRINT_OK:
+        if await get_image() != ok:
             continue
 
-        if finger.image_2_tz(1) != FINGERPRINT_OK:
+        if await run(image_2_tz, 1) != ok:
             continue
 
-        if finger.finger_search() != FINGERPRINT_OK:
+        result, user_id, confidence = await run(_finger_search)
+        if result != ok:
             continue
 
-        user_id = finger.finger_id
-        confidence = finger.confidence
-
-        if user_id not in load_used_ids():
+        if _ids_version != seen_version:
+            # version first: a change racing the reload only costs one more reload
+            seen_version = _ids_version
+            local_ids = load_used_ids()
+        if user_id not in local_ids:
             log_event(f"Denied ID {user_id}; not in local list", "F")
-            update_lcd("Fingerprint not", "approved")
-            await asyncio.sleep(2)
+            lcd("Fingerprint not", "approved")
+            await sleep(2)
             if _reset_to_home:
                 _reset_to_home()
             continue
 
-        update_lcd("Access granted", f"ID {user_id}")
+        lcd("Access granted", f"ID {user_id}")
         log_event(f"Access granted ID {user_id} (confidence={confidence})", "F")
         try:
-            camera_module.notify_recognized_event(user_id)
+            notify(user_id)
         except Exception as e:
             log_event(f"Camera notify_recognized_event error: {e}", "C")
 
         if _lock_input:
             _lock_input(True)
-        await asyncio.sleep(2)
-
-        while finger.get_image() != FINGERPRINT_NOFINGER:
-            await asyncio.sleep(0.1)
+        await _wait_finger_lifted(2)
 
         if _reset_to_home:
             _reset_to_home()
@@ -172,60 +370,58 @@ async def fingerprint_loop() -> None:
 # Registration + user PIN entry (exactly 4 digits)
 async def registration_blocking_loop() -> None:
     global register_mode, _pin_capture_active, _pin_capture_for_id
-    global _pin_confirm_stage, _pin_first_entry, _pin_capture_buffer
+    global _pin_confirm_stage, _pin_first, _pin_digits, _pin_len, _pin_done
 
     # 1) finger capture
     update_lcd("Place finger", "to enroll")
     log_event("Waiting for finger to enroll", "F")
 
     while register_mode:
-        if finger.get_image() == FINGERPRINT_OK:
+        if await _get_image_async() == FINGERPRINT_OK:
             break
         await asyncio.sleep(0.1)
     if not register_mode:
         return
 
-    if finger.image_2_tz(1) != FINGERPRINT_OK:
+    if await _s(finger.image_2_tz, 1) != FINGERPRINT_OK:
         update_lcd("Error", "first image")
         await asyncio.sleep(2)
         cancel_registration()
         return
 
     update_lcd("Remove finger", "")
-    while finger.get_image() != FINGERPRINT_NOFINGER:
-        await asyncio.sleep(0.1)
+    await _wait_finger_lifted()
 
     update_lcd("Place again", "")
     log_event("Waiting for second print", "F")
 
     while register_mode:
-        if finger.get_image() == FINGERPRINT_OK:
+        if await _get_image_async() == FINGERPRINT_OK:
             break
         await asyncio.sleep(0.1)
     if not register_mode:
         return
 
-    if finger.image_2_tz(2) != FINGERPRINT_OK:
+    if await _s(finger.image_2_tz, 2) != FINGERPRINT_OK:
         update_lcd("Unsuccessful", "try again")
         await asyncio.sleep(2)
         cancel_registration()
         return
 
-    if finger.create_model() != FINGERPRINT_OK:
+    if await _s(finger.create_model) != FINGERPRINT_OK:
         update_lcd("Error", "modeling")
         await asyncio.sleep(2)
         cancel_registration()
         return
 
-    used_ids = load_used_ids()
-    location = next((i for i in range(1, 127) if i not in used_ids), None)
+    location = _free_slot()
     if location is None:
         update_lcd("Error", "no slots")
         log_event("No free IDs according to local list", "F")
         cancel_registration()
         return
 
-    if finger.store_model(location) != FINGERPRINT_OK:
+    if await _s(finger.store_model, location) != FINGERPRINT_OK:
         update_lcd("Error", "saving")
         await asyncio.sleep(2)
         cancel_registration()
@@ -240,13 +436,14 @@ async def registration_blocking_loop() -> None:
     _pin_capture_for_id = location
     _pin_capture_active = True
     _pin_confirm_stage = 1
-    _pin_first_entry = ""
-    _pin_capture_buffer = ""
+    _pin_first = 0
+    _pin_digits = 0
+    _pin_len = 0
+    _pin_done = asyncio.Event()
     _show_pin_prompt()
 
-    # Wait for user to finish entry (registration_pin_key_input clears _pin_capture_active)
-    while register_mode and _pin_capture_active:
-        await asyncio.sleep(0.1)
+    # Wait for user to finish entry (registration_pin_key_input / cancel_registration set _pin_done)
+    await _pin_done.wait()
 
     if not register_mode:
         # cancelled during entry
@@ -266,101 +463,124 @@ async def registration_blocking_loop() -> None:
 
 
 def _show_pin_prompt(mask: bool = True) -> None:
-    stars = "*" * len(_pin_capture_buffer) if mask else _pin_capture_buffer
+    stars = "*" * _pin_len if mask else _pin_str()
     if len(stars) > 16:
         stars = stars[-16:]  # LCD second line max 16 chars
     header = "Enter PIN (4)" if _pin_confirm_stage == 1 else "Confirm PIN"
     update_lcd(header, f"digits: {stars}")
 
 
+def _pin_str() -> str:
+    return f"{_pin_digits:0{_pin_len}d}" if _pin_len else ""
+
+
 def registration_pin_key_input(key: str) -> None:
-    global _pin_capture_buffer, _pin_capture_active, _pin_confirm_stage, _pin_first_entry
+    global _pin_digits, _pin_len, _pin_capture_active, _pin_confirm_stage, _pin_first
 
     if not (register_mode and _pin_capture_active):
         return  # ignore if not in PIN entry
 
-    if key in "0123456789":
-        if len(_pin_capture_buffer) < 4:
-            _pin_capture_buffer += key
+    if key in _PIN_DIGITS:
+        if _pin_len < 4:
+            _pin_digits = _pin_digits * 10 + (ord(key) - 48)
+            _pin_len += 1
         _show_pin_prompt()
 
     elif key == "*":
-        _pin_capture_buffer = _pin_capture_buffer[:-1]
+        if _pin_len:
+            _pin_digits //= 10
+            _pin_len -= 1
         _show_pin_prompt()
 
     elif key == "#":
         # Confirm step - must be exactly 4 digits
-        if len(_pin_capture_buffer) != 4:
+        if _pin_len != 4:
             update_lcd("PIN must be", "exactly 4 digits")
-            asyncio.create_task(_flash_and_prompt_again())
+            _schedule_flash()
             return
 
         if _pin_confirm_stage == 1:
             # Store first entry and ask for confirmation
-            _pin_first_entry = _pin_capture_buffer
-            _pin_capture_buffer = ""
+            _pin_first = _pin_digits
+            _pin_digits = 0
+            _pin_len = 0
             _pin_confirm_stage = 2
             update_lcd("Confirm PIN", "enter again")
-            asyncio.create_task(_flash_and_prompt_again())
+            _schedule_flash()
             return
 
         # _pin_confirm_stage == 2
-        if _pin_capture_buffer != _pin_first_entry:
+        if _pin_digits != _pin_first:
             # Mismatch - restart
             update_lcd("Does not match", "Try again")
             log_event("PIN confirmation failed (mismatch)", "F")
-            _pin_capture_buffer = ""
-            _pin_first_entry = ""
+            _pin_digits = 0
+            _pin_len = 0
+            _pin_first = 0
             _pin_confirm_stage = 1
-            asyncio.create_task(_flash_and_prompt_again())
+            _schedule_flash()
             return
 
-        # Matches - check availability then store
-        try:
-            if is_user_pin_taken(_pin_capture_buffer):
-                update_lcd("PIN taken", "Choose another")
-                log_event("Entered personal PIN is already in use", "F")
-                # reset PIN entry process (back to step 1)
-                _pin_capture_buffer = ""
-                _pin_first_entry = ""
-                _pin_confirm_stage = 1
-                asyncio.create_task(_flash_and_prompt_again())
-                return
-
-            # securely store PIN for ID (PBKDF2 + salt + pepper)
-            add_user_pin(_pin_capture_for_id, _pin_capture_buffer)
-            log_event(f"Personal PIN stored for ID {_pin_capture_for_id}", "F")
-            _pin_capture_active = False  # signal to the registration loop that we are done
-
-        except ValueError as e:
+        # Matches - store it off the event loop (keys are ignored until it is done)
+        _pin_capture_active = False
+        asyncio.create_task(_store_pin(_pin_capture_for_id, _pin_str()))
+
+
+async def _store_pin(user_id: int, pin: str) -> None:
+    global _pin_digits, _pin_len, _pin_capture_active, _pin_confirm_stage, _pin_first
+    try:
+        # securely store PIN for ID (PBKDF2 + salt + pepper); add_user_pin also
+        # rejects a taken PIN, so the stored PINs are scanned once
+        await asyncio.get_running_loop().run_in_executor(None, add_user_pin, user_id, pin)
+    except ValueError as e:
+        if not register_mode:
+            return  # cancelled meanwhile
+        if isinstance(e, PinTakenError):
+            update_lcd("PIN taken", "Choose another")
+            log_event("Entered personal PIN is already in use", "F")
+        else:
             update_lcd("Invalid PIN", "exactly 4 digits (0-9)")
             log_event(f"Error saving PIN: {e}", "F")
-            # back to step 1
-            _pin_capture_buffer = ""
-            _pin_first_entry = ""
-            _pin_confirm_stage = 1
-            asyncio.create_task(_flash_and_prompt_again())
+        # reset PIN entry process (back to step 1)
+        _pin_digits = 0
+        _pin_len = 0
+        _pin_first = 0
+        _pin_confirm_stage = 1
+        _pin_capture_active = True
+        _schedule_flash()
+        return
 
+    log_event(f"Personal PIN stored for ID {user_id}", "F")
+    if _pin_done is not None:
+        _pin_done.set()  # signal to the registration loop that we are done
 
-async def _flash_and_prompt_again() -> None:
-    await asyncio.sleep(1.2)
-    _show_pin_prompt()
+
+def _schedule_flash() -> None:
+    # redraw the prompt after a message; one pending redraw at most
+    global _flash_handle
+    if _flash_handle is not None:
+        _flash_handle.cancel()
+    _flash_handle = asyncio.get_running_loop().call_later(1.2, _show_pin_prompt)
 
 
 # Helper operations on the sensor
 def get_registered_ids():
-    if not finger.verify_password() or not finger.read_templates():
-        log_event("Failure: get_registered_ids() -> auth/read_templates", "F")
-        return []
-    return finger.templates
+    with _sensor_lock:
+        # read_templates() returns a status code (FINGERPRINT_OK on success)
+        if not finger.verify_password() or finger.read_templates() != FINGERPRINT_OK:
+            log_event("Failure: get_registered_ids() -> auth/read_templates", "F")
+            return []
+        return list(finger.templates)
 
 
 def delete_fingerprint(finger_id: int) -> bool:
-    if not finger.verify_password():
-        log_event("Failure: delete_fingerprint() -> password", "F")
-        return False
-    if finger.delete_model(int(finger_id)) == FINGERPRINT_OK:
-        ids_delete(int(finger_id))
+    with _sensor_lock:
+        if not finger.verify_password():
+            log_event("Failure: delete_fingerprint() -> password", "F")
+            return False
+        deleted = finger.delete_model(int(finger_id)) == FINGERPRINT_OK
+    if deleted:
+        _forget_used_id(finger_id)
         log_event(f"Fingerprint ID {finger_id} deleted", "F")
         return True
     else:
@@ -1,10 +1,16 @@
+import atexit
 import datetime
+from collections import deque
+import hmac
+import mmap
 import os
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import messagebox, scrolledtext, ttk
 from progressive_enroll import get_progress_for_ids, remove_user, clear_all_users
 import cv2
-from PIL import Image, ImageTk
 
 from config_manager import (
     security_init,
@@ -13,10 +19,12 @@ from config_manager import (
     generate_registration_pin as cfg_generate_registration_pin,
     remove_pins_for_id,
     wipe_all_user_pins,
+    local_time,
 )
 
 from fingerprint.fingerprint_sensor import (
     load_used_ids,
+    used_ids_version,
     delete_used_id,
     clear_used_ids,
     delete_all_fingerprints,
@@ -35,29 +43,107 @@ def _today_log_path() -> str:
     return os.path.join(LOG_DIR, f"log_{datetime.date.today()}.txt")
 
 SYSTEM_LOG_FILE = _today_log_path()
-if not os.path.exists(SYSTEM_LOG_FILE):
-    with open(SYSTEM_LOG_FILE, "w"):
-        pass
+
+# One long-lived buffered handle for the system log (log_event is called from the
+# event loop, camera and GUI threads); a daemon thread flushes it every
+# LOG_FLUSH_SEC and once more at exit. It is reopened when the date rolls over.
+LOG_FLUSH_SEC = 2.0
+_log_lock = threading.Lock()
+_log_fh = open(SYSTEM_LOG_FILE, "a", buffering=8192)
+
+def flush_log() -> None:
+    with _log_lock:
+        _log_fh.flush()
+
+def _log_flush_loop() -> None:
+    while True:
+        time.sleep(LOG_FLUSH_SEC)
+        flush_log()
+
+def _write_log(entry: str, today: str) -> None:
+    global SYSTEM_LOG_FILE, _log_fh
+    with _log_lock:
+        path = os.path.join(LOG_DIR, f"log_{today}.txt")
+        if path != SYSTEM_LOG_FILE:
+            _log_fh.close()
+            _log_fh = open(path, "a", buffering=8192)
+            SYSTEM_LOG_FILE = path
+        _log_fh.write(entry)
+
+atexit.register(flush_log)
+threading.Thread(target=_log_flush_loop, name="log-flush", daemon=True).start()
 
 
 # GUI globals
 gui_log_area = None
 config = load_config()
-current_log_entries = []
+# admin credentials, read once; the hash is compared as bytes in constant time
+_admin_user = config.get("username")
+_admin_hash = str(config.get("password_hash") or "").encode()
+# entries shown in the log view; capped at LOG_VIEW_MAX unless a full log is loaded
+LOG_VIEW_MAX = 5000
+current_log_entries = deque(maxlen=LOG_VIEW_MAX)
+current_log_by_type = {}  # "[G]"/"[P]"/... -> the entries of that type, in order
 status_label = None
 camera_label = None
 
 
 # Log helpers
 def log_event(event: str, log_type: str = "G") -> None:
-    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-    entry = f"[{timestamp}] [{log_type}] {event}\n"
-    with open(SYSTEM_LOG_FILE, "a") as f:
-        f.write(entry)
+    today, clock = local_time("%Y-%m-%d %H:%M:%S").split(" ")  # one read: date and time agree
+    entry = f"[{clock}] [{log_type}] {event}\n"
+    _write_log(entry, today)
     current_log_entries.append(entry)
+    bucket = current_log_by_type.get(f"[{log_type}]")
+    if bucket is None:
+        bucket = current_log_by_type[f"[{log_type}]"] = deque(maxlen=current_log_entries.maxlen)
+    bucket.append(entry)
     if gui_log_area:
         gui_log_area.after(0, lambda e=entry: append_to_gui_log(e))
 
+# the log view loads only the last LOG_TAIL_BYTES of a file unless asked for all of it
+LOG_TAIL_BYTES = 256 * 1024
+
+def _read_log_lines(path: str, full: bool = False) -> list:
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []  # mmap cannot map an empty file
+        start = 0 if full else max(0, size - LOG_TAIL_BYTES)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:].decode(errors="replace")
+    if start:
+        text = text[text.find("\n") + 1:]  # drop the partial first line
+    return text.splitlines(keepends=True)
+
+def _list_logs() -> list:
+    with os.scandir(LOG_DIR) as it:
+        return sorted(e.name for e in it if e.is_file())
+
+# sorted enrolled IDs for the popups, rebuilt only when the ID cache version changes
+_sorted_ids_cache = (-1, [])
+
+def _sorted_ids() -> list:
+    global _sorted_ids_cache
+    version, ids = _sorted_ids_cache
+    current = used_ids_version()  # read first: a change racing the reload only costs a rebuild
+    if current != version:
+        ids = sorted(load_used_ids())
+        _sorted_ids_cache = (current, ids)
+    return ids
+
+def _set_log_entries(lines, maxlen=LOG_VIEW_MAX) -> None:
+    # entries look like "[HH:MM:SS] [T] message"; bucket them by their "[T]" tag
+    global current_log_entries, current_log_by_type
+    entries = deque(lines, maxlen=maxlen)
+    by_type = {}
+    for entry in entries:
+        bucket = by_type.get(entry[11:14])
+        if bucket is None:
+            bucket = by_type[entry[11:14]] = deque(maxlen=maxlen)
+        bucket.append(entry)
+    current_log_entries, current_log_by_type = entries, by_type
+
 def append_to_gui_log(entry: str) -> None:
     if not gui_log_area:
         return
@@ -66,31 +152,99 @@ def append_to_gui_log(entry: str) -> None:
 
 
 # GUI
+# The preview is rendered by a worker thread (fetch, resize, PPM encode) into a
+# 1-slot queue; the Tk side only polls it and builds the PhotoImage.
+PREVIEW_MS = 200          # preview refresh (~5x per second)
+PREVIEW_POLL_MS = 50      # Tk-side check for a new preview frame
+PREVIEW_HIDDEN_MS = 2000  # visibility re-check while the window is not shown
+
 def start_gui() -> None:
+    preview_q = queue.Queue(maxsize=1)   # newest (ppm bytes or None, status)
+    preview_on = threading.Event()      # set while the preview is visible
+    shown_status = None
+
+    def preview_worker():
+        # buffers reused by every frame once the first one allocated them
+        frame_buf = None
+        small_buf = None
+        while True:
+            preview_on.wait()
+            t0 = time.monotonic()
+            frame, status = get_latest_frame_and_status(frame_buf)
+            ppm = None
+            if frame is not None:
+                frame_buf = frame
+                # shrink for display and encode a binary PPM (raw header + pixels;
+                # imencode takes BGR and writes PPM's RGB order itself)
+                small_buf = cv2.resize(frame, (320, 240), dst=small_buf,
+                                       interpolation=cv2.INTER_NEAREST)  # preview only
+                ok, buf = cv2.imencode(".ppm", small_buf)
+                if ok:
+                    ppm = buf.tobytes()
+            try:
+                preview_q.put_nowait((ppm, status))
+            except queue.Full:
+                # drop the frame Tk has not picked up; this is the only producer
+                try:
+                    preview_q.get_nowait()
+                except queue.Empty:
+                    pass
+                preview_q.put_nowait((ppm, status))
+            time.sleep(max(0.0, PREVIEW_MS / 1000 - (time.monotonic() - t0)))
+
     def update_camera_feed():
-        frame, status = get_latest_frame_and_status()
-
-        if frame is not None and camera_label is not None:
-            # BGR -> RGB, shrink for display
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image = cv2.resize(image, (320, 240))
-            imgtk = ImageTk.PhotoImage(image=Image.fromarray(image))
-            camera_label.imgtk = imgtk  # prevent GC
-            camera_label.config(image=imgtk)
-
-        if status_label is not None:
-            status_label.config(
-                text=status,
-                fg=("red" if str(status).lower().startswith("record") else "green"),
-            )
-
-        # refresh ~5x per second
-        if camera_label is not None:
-            camera_label.after(200, update_camera_feed)
+        nonlocal shown_status
+        if camera_label is None:
+            return
+
+        # minimized / hidden window: nothing to draw, check back less often
+        if not camera_label.winfo_viewable():
+            preview_on.clear()
+            camera_label.after(PREVIEW_HIDDEN_MS, update_camera_feed)
+            return
+        preview_on.set()
+
+        try:
+            ppm, status = preview_q.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            if ppm is not None:
+                imgtk = tk.PhotoImage(data=ppm, format="PPM")
+                camera_label.imgtk = imgtk  # prevent GC
+                camera_label.config(image=imgtk)
+
+            if status_label is not None and status != shown_status:
+                status_label.config(
+                    text=status,
+                    fg=("red" if str(status).lower().startswith("record") else "green"),
+                )
+                shown_status = status
+
+        camera_label.after(PREVIEW_POLL_MS, update_camera_feed)
 
     def show_main_gui():
-        
+        # ID and progress popups are built once; closing only hides them and opening
+        # again re-shows the same window with fresh contents
+        popups = {}  # name -> (Toplevel, refresh function)
+
+        def reopen_popup(name):
+            entry = popups.get(name)
+            if entry is None or not entry[0].winfo_exists():
+                return False
+            popup, refresh = entry
+            popup.deiconify()
+            popup.lift()
+            refresh()
+            return True
+
+        def keep_popup(name, popup, refresh):
+            popup.protocol("WM_DELETE_WINDOW", popup.withdraw)
+            popups[name] = (popup, refresh)
+
         def show_progress_status():
+            if reopen_popup("progress"):
+                return
             popup = tk.Toplevel()
             popup.title("Progressive enrollment status")
             popup.resizable(False, False)
@@ -102,24 +256,30 @@ def start_gui() -> None:
                 tree.column(c, width=140, anchor="center")
             tree.pack(padx=10, pady=10)
 
-            try:
-                # 1) Fetch all REGISTERED IDs from the sensor
-                ids = sorted(load_used_ids())  # e.g., {1, 2, 5, ...}
-                # 2) Get progress for those IDs (IDs without video will get 0/target)
-                rows = get_progress_for_ids(ids) if ids else []
-
-                # 3) Fill the table: ID | "x/target" | True/False
-                for r in rows:
-                    status_text = f'{r["count"]}/{r["target"]}'
-                    ready_text = "True" if r["ready"] else "False"
-                    tree.insert("", tk.END, values=(r["user_id"], status_text, ready_text))
-
-                if not rows:
-                    # No IDs - show empty grid without error
-                    pass
+            def fill_table():
+                tree.delete(*tree.get_children())
+                try:
+                    # 1) Fetch all REGISTERED IDs from the sensor
+                    ids = _sorted_ids()  # e.g., [1, 2, 5, ...]
+                    # 2) Get progress for those IDs (IDs without video will get 0/target)
+                    rows = get_progress_for_ids(ids) if ids else []
+
+                    # 3) Fill the table: ID | "x/target" | True/False
+                    for r in rows:
+                        status_text = f'{r["count"]}/{r["target"]}'
+                        ready_text = "True" if r["ready"] else "False"
+                        tree.insert("", tk.END, values=(r["user_id"], status_text, ready_text))
+
+                    if not rows:
+                        # No IDs - show empty grid without error
+                        pass
+
+                except Exception as e:
+                    messagebox.showerror("Error", f"Cannot load status.\n{e}")
+
+            keep_popup("progress", popup, fill_table)
+            fill_table()
 
-            except Exception as e:
-                messagebox.showerror("Error", f"Cannot load status.\n{e}")
         def on_generate_registration_pin():
             try:
                 pin = cfg_generate_registration_pin()
@@ -177,29 +337,33 @@ def start_gui() -> None:
             except Exception as e:
                 messagebox.showerror("Error", f"Unable to generate PIN.\nDetails: {e}")
 
-        def load_selected_log(_=None):
+        def load_selected_log(_=None, full=False):
             selected = log_selector.get().strip()
             path = os.path.join(LOG_DIR, selected) if selected else SYSTEM_LOG_FILE
+            flush_log()  # show what is still buffered for today's file
             if os.path.exists(path):
-                with open(path, "r") as f:
-                    if gui_log_area:
-                        gui_log_area.delete(1.0, tk.END)
-                    current_log_entries.clear()
-                    current_log_entries.extend(f.readlines())
-                    apply_filter()
+                lines = _read_log_lines(path, full)
+                if gui_log_area:
+                    gui_log_area.delete(1.0, tk.END)
+                _set_log_entries(lines, None if full else LOG_VIEW_MAX)
+                apply_filter()
 
         def apply_filter(_=None):
             selected_filter = filter_selector.get()
             if not gui_log_area:
                 return
             gui_log_area.delete(1.0, tk.END)
-            flt = (None if selected_filter == "All" else f"[{selected_filter}]")
-            for entry in current_log_entries:
-                if flt is None or flt in entry:
-                    gui_log_area.insert(tk.END, entry)
+            if selected_filter == "All":
+                entries = current_log_entries
+            else:
+                entries = current_log_by_type.get(f"[{selected_filter}]", ())
+            # one insert of the joined text; Tk handles that far better than a line at a time
+            gui_log_area.insert(tk.END, "".join(entries))
             gui_log_area.see(tk.END)
 
         def manage_ids():
+            if reopen_popup("ids"):
+                return
             popup = tk.Toplevel()
             popup.title("Manage IDs")
 
@@ -209,8 +373,7 @@ def start_gui() -> None:
 
             def refresh_list():
                 listbox.delete(0, tk.END)
-                for fid in sorted(load_used_ids()):
-                    listbox.insert(tk.END, f"ID {fid}")
+                listbox.insert(tk.END, *[f"ID {fid}" for fid in _sorted_ids()])  # one Tcl call
                 delete_button.config(state="disabled")
 
             def on_select(_evt):
@@ -262,6 +425,7 @@ def start_gui() -> None:
             delete_button.pack(pady=5)
             tk.Button(popup, text="Delete all IDs and fingerprints", command=delete_all).pack(pady=(0, 10))
 
+            keep_popup("ids", popup, refresh_list)
             refresh_list()
 
         # UI Layout
@@ -292,25 +456,25 @@ def start_gui() -> None:
         gui_log_area.grid(row=2, column=0)
 
         tk.Label(left_frame, text="Select log file:").grid(row=3, column=0, pady=(10, 0))
-        files = sorted(os.listdir(LOG_DIR))
-        log_selector = ttk.Combobox(left_frame, width=47, values=files)
-        today_name = os.path.basename(SYSTEM_LOG_FILE)
-        if today_name not in files:
-            files.append(today_name)
-            log_selector.configure(values=sorted(files))
-        log_selector.set(today_name)
+        # the file list is read when the dropdown opens, not up front
+        log_selector = ttk.Combobox(left_frame, width=47)
+        log_selector.configure(postcommand=lambda: log_selector.configure(values=_list_logs()))
+        log_selector.set(os.path.basename(SYSTEM_LOG_FILE))
         log_selector.grid(row=4, column=0, pady=5)
 
-        tk.Label(left_frame, text="Filter by message type:").grid(row=5, column=0, pady=(10, 0))
+        tk.Button(left_frame, text="Load full log", width=30, command=lambda: load_selected_log(full=True))\
+            .grid(row=5, column=0)
+
+        tk.Label(left_frame, text="Filter by message type:").grid(row=6, column=0, pady=(10, 0))
         filter_selector = ttk.Combobox(left_frame, width=47, values=["All", "G", "P", "C", "F"])
         filter_selector.set("All")
-        filter_selector.grid(row=6, column=0, pady=5)
+        filter_selector.grid(row=7, column=0, pady=5)
 
         tk.Button(left_frame, text="Manage IDs", width=30, command=manage_ids)\
-            .grid(row=7, column=0, pady=(10, 0))
+            .grid(row=8, column=0, pady=(10, 0))
         
         tk.Button(left_frame, text="Progressive enrollment status", width=30, command=show_progress_status)\
-            .grid(row=8, column=0, pady=(10, 0))
+            .grid(row=9, column=0, pady=(10, 0))
     
         # Camera (right)
         tk.Label(right_frame, text="Camera").pack()
@@ -325,14 +489,16 @@ def start_gui() -> None:
         filter_selector.bind("<<ComboboxSelected>>", apply_filter)
 
         load_selected_log()
+        threading.Thread(target=preview_worker, name="gui-preview", daemon=True).start()
         update_camera_feed()
         log_event("GUI started", "G")
         root.mainloop()
 
     def try_login():
         entered_user = user_entry.get().strip()
-        entered_pass = hash_password(pass_entry.get())
-        if entered_user == config.get("username") and entered_pass == config.get("password_hash"):
+        entered_pass = hash_password(pass_entry.get()).encode()
+        pass_ok = hmac.compare_digest(entered_pass, _admin_hash)  # always evaluated
+        if entered_user == _admin_user and pass_ok:
             login_win.destroy()
             show_main_gui()
         else:
@@ -1,35 +1,88 @@
 from gpiozero import OutputDevice, Button
 from signal import pause
 import asyncio
+import threading
+import time
 
-# Key layout
-KEYPAD = [
-    ["D", "C", "B", "A"],
-    ["#", "9", "6", "3"],
-    ["0", "8", "5", "2"],
-    ["*", "7", "4", "1"]
-]
+# Key layout, row-major: key at (row, col) is KEYPAD[row * KEYPAD_COLS + col]
+KEYPAD_COLS = 4
+KEYPAD = (
+    "D", "C", "B", "A",
+    "#", "9", "6", "3",
+    "0", "8", "5", "2",
+    "*", "7", "4", "1",
+)
 
 
 # GPIO pins (BCM)
 ROW_PINS = [4, 17, 27, 22]    # R1-R4 as outputs
 COL_PINS = [5, 6, 13, 19]     # C1-C4 as inputs with pull-down
 
+KEY_DEBOUNCE_SEC = 0.3        # ignore further presses this long after a key
+
 # Initialize rows (output, HIGH/LOW)
 rows = [OutputDevice(pin, active_high=True, initial_value=False) for pin in ROW_PINS]
 
 # Initialize columns (input with pull-down)
 cols = [Button(pin, pull_up=False, bounce_time=0.05) for pin in COL_PINS]
 
-# Main keypad scanning function
-async def scan_keys(callback):
-    while True:
+_scan_lock = threading.Lock()
+_last_key_at = 0.0
+
+
+def _find_row(col) -> int:
+    # a column fired: energize the rows one at a time to see which one it is on.
+    # Callers hold _scan_lock, so the edges this causes are ignored.
+    for row in rows:
+        row.off()
+    try:
         for row_index, row in enumerate(rows):
-            row.on()  # drive row HIGH
-            for col_index, col in enumerate(cols):
-                if col.is_pressed:
-                    key = KEYPAD[row_index][col_index]
-                    callback(key)
-                    await asyncio.sleep(0.3)  # debounce
-            row.off()  # drive row back LOW
-        await asyncio.sleep(0.01)  # short pause for CPU
+            row.on()
+            pressed = col.is_pressed
+            row.off()
+            if pressed:
+                return row_index
+        return -1
+    finally:
+        for row in rows:
+            row.on()  # idle state: every row HIGH, so any key raises its column
+
+
+def _column_handler(col_index: int, loop: asyncio.AbstractEventLoop, callback):
+    col = cols[col_index]
+    keys = KEYPAD[col_index::KEYPAD_COLS]  # this column's key for each row
+
+    def on_press() -> None:
+        global _last_key_at
+        if not _scan_lock.acquire(blocking=False):
+            return  # edge caused by our own row scan
+        try:
+            now = time.monotonic()
+            if now - _last_key_at < KEY_DEBOUNCE_SEC:
+                return
+            row_index = _find_row(col)
+            if row_index < 0:
+                return  # released before the scan
+            _last_key_at = now
+            # gpiozero calls this from its own thread; the key handler belongs on the loop
+            loop.call_soon_threadsafe(callback, keys[row_index])
+        finally:
+            _scan_lock.release()
+
+    return on_press
+
+
+# Keypad reader: column edges instead of a polling scan; keeps running until cancelled
+async def scan_keys(callback):
+    loop = asyncio.get_running_loop()
+    for col_index, col in enumerate(cols):
+        col.when_pressed = _column_handler(col_index, loop, callback)
+    for row in rows:
+        row.on()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for col in cols:
+            col.when_pressed = None
+        for row in rows:
+            row.off()
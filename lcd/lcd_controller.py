@@ -2,11 +2,17 @@ from RPLCD.i2c import CharLCD
 from time import sleep
 
 lcd = CharLCD('PCF8574', address=0x27, port=1, cols=16, rows=2)
+lcd.clear()
 
+LCD_COLS = 16
+_shown = [None, None]  # text currently on each row (padded to LCD_COLS)
 
 
 def update_lcd(line1='', line2=''):
-    lcd.clear()
-    lcd.write_string(line1[:16])
-    lcd.crlf()
-    lcd.write_string(line2[:16])
+    # rewrite only rows whose text changed; padding overwrites the old text, so no clear()
+    for row, text in enumerate((line1, line2)):
+        text = text[:LCD_COLS].ljust(LCD_COLS)
+        if text != _shown[row]:
+            lcd.cursor_pos = (row, 0)
+            lcd.write_string(text)
+            _shown[row] = text
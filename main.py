@@ -1,5 +1,9 @@
 import asyncio
+import signal
+import sys
 import threading
+from dataclasses import dataclass, field
+from typing import Optional
 
 from gui import log_event, start_gui
 from lcd.lcd_controller import update_lcd
@@ -7,6 +11,7 @@ from keypad.keypad_reader import scan_keys
 
 import camera.camera_module as camera_module
 from camera.camera_module import start_camera_recording
+from progressive_enroll import flush_loop as enroll_flush_loop
 
 # fingerprint module and API
 import fingerprint.fingerprint_sensor as fingerprint_sensor
@@ -31,94 +36,145 @@ camera_module.set_camera_logger(log_event)
 fingerprint_sensor.set_logger(log_event)
 
 
-# Global PIN entry state
-pin_buffer = ""
-pin_mode = False
-input_locked = False
+PIN_MAX = 8
+_STARS = tuple("*" * n for n in range(PIN_MAX + 1))  # LCD masks, indexed by length
+
+
+# PIN entry state. It is only touched on the event loop: keypad presses arrive via
+# call_soon_threadsafe, and the callbacks handed to the fingerprint module hop
+# onto the loop when they are called from another thread.
+@dataclass
+class PinState:
+    buffer: bytearray = field(default_factory=lambda: bytearray(PIN_MAX))  # ASCII keys
+    length: int = 0  # keys entered; the first `length` bytes of buffer are valid
+    mode: bool = False
+    locked: bool = False
+
+
+_pin = PinState()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pending_reset: Optional[asyncio.TimerHandle] = None  # home screen after a PIN result
+RESET_DELAY_SEC = 3.0
+
+
+def _on_loop(func):
+    def call(*args):
+        loop = _loop
+        if loop is not None:
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not loop:
+                loop.call_soon_threadsafe(func, *args)
+                return
+        func(*args)
+    return call
 
 
 def reset_to_home():
-    global pin_buffer, pin_mode
-    pin_buffer = ""
-    pin_mode = False
+    _pin.length = 0
+    _pin.mode = False
     update_lcd("Enter PIN", "or scan fingerprint")
 
 
-set_reset_callback(reset_to_home)
+set_reset_callback(_on_loop(reset_to_home))
 
 
 def lock_input(state: bool):
-    global input_locked
-    input_locked = state
+    _pin.locked = state
 
 
-set_input_lock(lock_input)
+set_input_lock(_on_loop(lock_input))
 
 
 def update_pin_display():
-    stars = "*" * len(pin_buffer)
-    update_lcd("PIN entry:", stars)
+    update_lcd("PIN entry:", _STARS[_pin.length])
+
+
+def _append_key(key):
+    # User PINs are 1-8 digits 0-9
+    n = _pin.length
+    if n < PIN_MAX:
+        _pin.buffer[n] = ord(key)
+        _pin.length = n + 1
+        update_pin_display()
+
+
+def _backspace():
+    _pin.length = max(0, _pin.length - 1)
+    update_pin_display()
+
+
+def _submit():
+    raw_entered = _pin.buffer[:_pin.length].decode("ascii")  # e.g., "0427"
+
+    # 1) REGISTRATION: try to consume a one-time registration PIN
+    if _pin.length == 4 and raw_entered.isdigit():
+        if consume_registration_pin(raw_entered):
+            log_event("Registration PIN accepted", "F")
+            update_lcd("Reg PIN accepted", "Start enrollment")
+            enable_registration()
+            return
+
+    # 2) ENTRY: user PIN, look up ID
+    user_id = get_id_for_entered_pin(raw_entered)
+    if user_id is not None:
+        update_lcd("Access granted", f"ID {user_id}")
+        log_event(f"Access granted by user PIN (ID {user_id})", "P")
+        try:
+            camera_module.notify_recognized_event(user_id)  # only queues the ID
+        except Exception as e:
+            log_event(f"Camera notify_recognized_event error: {e}", "C")
+    else:
+        update_lcd("Access denied", "")
+        log_event("Access denied (wrong user PIN)", "P")
+    _pin.mode = False  # a key pressed before the reset starts a new entry
+    _schedule_reset()
+
+
+_PIN_KEYS = frozenset("0123456789ABCD")
+_SPECIAL_KEYS = {"*": _backspace, "#": _submit}
 
 
 def handle_pin_input(key):
     # During registration, keys are routed to user PIN entry
-    if input_locked:
+    if _pin.locked:
         if is_registering():
             registration_pin_key_input(key)
         return
 
-    global pin_buffer, pin_mode
+    _cancel_reset()  # typing again keeps the new entry on screen
+    if not _pin.mode:
+        _pin.mode = True
+        _pin.length = 0
 
-    if not pin_mode:
-        pin_mode = True
-        pin_buffer = ""
+    handler = _SPECIAL_KEYS.get(key)
+    if handler is not None:
+        handler()
+    elif key in _PIN_KEYS:
+        _append_key(key)
 
-    if key in "0123456789ABCD":
-        # User PINs are 1-8 digits 0-9
-        if len(pin_buffer) < 8:
-            pin_buffer += key
-            update_pin_display()
 
-    elif key == "*":
-        pin_buffer = pin_buffer[:-1]
-        update_pin_display()
+def _cancel_reset():
+    global _pending_reset
+    if _pending_reset is not None:
+        _pending_reset.cancel()
+        _pending_reset = None
 
-    elif key == "#":
-        raw_entered = pin_buffer  # e.g., "0427"
 
-        # 1) REGISTRATION: try to consume a one-time registration PIN
-        if raw_entered.isdigit() and len(raw_entered) == 4:
-            if consume_registration_pin(raw_entered):
-                log_event("Registration PIN accepted", "F")
-                update_lcd("Reg PIN accepted", "Start enrollment")
-                enable_registration()
-                return
-
-        # 2) ENTRY: user PIN, look up ID
-        user_id = get_id_for_entered_pin(raw_entered)
-        if user_id is not None:
-            update_lcd("Access granted", f"ID {user_id}")
-            log_event(f"Access granted by user PIN (ID {user_id})", "P")
-            try:
-                # Intentionally left (if function missing, it will be logged)
-                camera_module.notify_recoadgnized_event(user_id)
-            except Exception as e:
-                log_event(f"Camera notify_recognized_event error: {e}", "C")
-            asyncio.create_task(reset_after_delay())
-        else:
-            update_lcd("Access denied", "")
-            log_event("Access denied (wrong user PIN)", "P")
-            asyncio.create_task(reset_after_delay())
-
-
-async def reset_after_delay():
-    await asyncio.sleep(3)
-    reset_to_home()
+def _schedule_reset():
+    global _pending_reset
+    _cancel_reset()
+    _pending_reset = asyncio.get_running_loop().call_later(RESET_DELAY_SEC, reset_to_home)
 
 
 async def main():
+    global _loop
+    _loop = asyncio.get_running_loop()
     reset_to_home()
     asyncio.create_task(fingerprint_loop())
+    asyncio.create_task(enroll_flush_loop())
     await scan_keys(handle_pin_input)
 
 
@@ -127,6 +183,16 @@ if __name__ == "__main__":
     threading.Thread(target=start_gui, daemon=True).start()
     threading.Thread(target=start_camera_recording, daemon=True).start()
 
+    # SIGTERM (e.g. systemd stop) exits normally so atexit flushes pending state
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    # uvloop (optional) is a faster drop-in event loop on Linux
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     # Start the security system
     try:
         asyncio.run(main())
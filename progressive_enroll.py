@@ -1,9 +1,18 @@
 # progressive_enroll.py
-import os, json
+import os, json, atexit, asyncio, time
 from threading import Lock
 from datetime import datetime
 from typing import Dict, Any, List
 
+# orjson when installed (C parse/serialize, works on bytes), stdlib json otherwise
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+    def _dumps(o): return json.dumps(o, separators=(",",":")).encode()
+
 DATA_DIR = "data"
 STATE_FILE = os.path.join(DATA_DIR, "progressive_enroll.json")
 TARGET_SAMPLES = 20
@@ -11,91 +20,166 @@ MIN_QUALITY = 0.80
 
 _lock = Lock()
 
-def _now(): return datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+def _now(): return int(time.time())  # stored as epoch seconds, formatted when read
+
+def _fmt_ts(ts):
+    # epoch seconds -> local ISO time; older files hold the ISO string already
+    if isinstance(ts, (int, float)):
+        return datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+    return ts
 
 
 def _ensure():
     os.makedirs(DATA_DIR, exist_ok=True)
     if not os.path.exists(STATE_FILE):
-        with open(STATE_FILE,"w") as f:
-            json.dump({"target":TARGET_SAMPLES,"min_quality":MIN_QUALITY,"users":{}}, f, indent=2)
+        _atomic_write({"target":TARGET_SAMPLES,"min_quality":MIN_QUALITY,"users":{}})
+
+# Parsed state kept in memory; the file is only re-read when its mtime shows it was
+# changed outside this process. Both helpers expect the caller to hold _lock.
+# Changes mark the state dirty and are written by flush(): every FLUSH_SEC from
+# flush_loop() on the event loop, and once more at exit.
+FLUSH_SEC = 2.0
+_state_cache = None
+_state_mtime = None
+_dirty = False
+
+def _load_state():
+    global _state_cache, _state_mtime
+    if _dirty:
+        return _state_cache  # unflushed changes: memory is newer than the file
+    try:
+        mtime = os.stat(STATE_FILE).st_mtime_ns
+    except FileNotFoundError:
+        _ensure()
+        mtime = os.stat(STATE_FILE).st_mtime_ns
+    if _state_cache is None or mtime != _state_mtime:
+        with open(STATE_FILE,"rb") as f: _state_cache = _from_disk(_loads(f.read()))
+        _state_mtime = mtime
+    return _state_cache
+
+# In memory "users" is keyed by int user ID; JSON object keys are strings, so keys
+# are converted only when the state is read from or written to the file. Loading
+# also normalizes the value types once, so readers use them as they are.
+def _from_disk(st):
+    st["target"] = int(st.get("target",TARGET_SAMPLES))
+    st["min_quality"] = float(st.get("min_quality",MIN_QUALITY))
+    users = {}
+    for k,u in st.get("users",{}).items():
+        u["count"] = int(u.get("count",0))
+        u["ready"] = bool(u.get("ready",False))
+        u.setdefault("last", None)
+        users[int(k)] = u
+    st["users"] = users
+    return st
+
+def _to_disk(st):
+    return {**st, "users": {str(k): u for k,u in st.get("users",{}).items()}}
+
+def _atomic_write(st):
+    # compact JSON to a temp file, fsync, rename over the state file: a crash leaves
+    # either the old or the new file, never a truncated one
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp,"wb") as f:
+        f.write(_dumps(_to_disk(st)))
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, STATE_FILE)
+
+def _save_state(st):
+    global _state_cache, _dirty
+    _state_cache = st
+    _dirty = True
+
+def flush():
+    global _state_mtime, _dirty
+    with _lock:
+        if not _dirty: return
+        _atomic_write(_state_cache)
+        _state_mtime = os.stat(STATE_FILE).st_mtime_ns
+        _dirty = False
+
+async def flush_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(FLUSH_SEC)
+        if _dirty:
+            try: await loop.run_in_executor(None, flush)
+            except OSError: pass  # still dirty, retried next round
+
+atexit.register(flush)
+
+_ensure()
+
+_NO_PROGRESS = {"count":0,"ready":False,"last":None}
+
+def _snapshot():
+    # published states are never modified (writers replace them), so readers only
+    # need the lock to fetch the current one
+    with _lock: return _load_state()
+
+def _editable(st):
+    # copy-on-write: new top level and users dict; change user records by replacing them
+    return {**st, "users": dict(st.get("users",{}))}
 
 def get_policy():
-    _ensure()
-    with open(STATE_FILE,"r") as f: st = json.load(f)
-    return int(st.get("target",TARGET_SAMPLES)), float(st.get("min_quality",MIN_QUALITY))
+    st = _snapshot()
+    return st["target"], st["min_quality"]
 
 def configure(target:int=None, min_quality:float=None):
-    _ensure()
-    with _lock, open(STATE_FILE,"r") as f:
-        st = json.load(f)
-    if target is not None: st["target"]=int(target)
-    if min_quality is not None: st["min_quality"]=float(min_quality)
-    with open(STATE_FILE,"w") as f: json.dump(st,f,indent=2)
+    with _lock:
+        st = _editable(_load_state())
+        if target is not None: st["target"]=int(target)
+        if min_quality is not None: st["min_quality"]=float(min_quality)
+        _save_state(st)
 
 def should_collect(user_id:int)->bool:
-    _ensure()
-    with _lock, open(STATE_FILE,"r") as f:
-        st = json.load(f)
-    u = st["users"].get(str(user_id), {"count":0,"ready":False})
-    return not u.get("ready",False)
+    u = _snapshot()["users"].get(int(user_id))
+    return u is None or not u["ready"]
 
 def record_accepted_clip(user_id:int, video_path:str, score:float, details:Dict[str,Any]):
-    _ensure()
-    with _lock, open(STATE_FILE,"r") as f:
-        st = json.load(f)
-    u = st["users"].setdefault(str(user_id), {"count":0,"ready":False,"last":None})
-    u["count"] = int(u.get("count",0))+1
-    target = int(st.get("target",TARGET_SAMPLES))
-    if u["count"] >= target: u["ready"]=True
-    u["last"] = {"ts":_now(), "path":video_path, "score":round(score,3)}
-    with open(STATE_FILE,"w") as f: json.dump(st,f,indent=2)
+    with _lock:
+        st = _editable(_load_state())
+        u = dict(st["users"].get(int(user_id)) or {"count":0,"ready":False,"last":None})
+        u["count"] += 1
+        if u["count"] >= st["target"]: u["ready"]=True
+        u["last"] = {"ts":_now(), "path":video_path, "score":round(score,3)}
+        st["users"][int(user_id)] = u
+        _save_state(st)
 
 def get_progress()->List[Dict[str,Any]]:
-    _ensure()
-    with open(STATE_FILE,"r") as f:
-        st = json.load(f)
-    target = int(st.get("target",TARGET_SAMPLES))
-    rows=[]
-    for k,u in st.get("users",{}).items():
-        rows.append({
-            "user_id": int(k),
-            "count": int(u.get("count",0)),
-            "target": target,
-            "ready": bool(u.get("ready",False)),
-            "last_update": u.get("last",{}).get("ts","")
-        })
-    rows.sort(key=lambda r: r["user_id"])
-    return rows
+    st = _snapshot()
+    target = st["target"]
+    return [{
+        "user_id": k,
+        "count": u["count"],
+        "target": target,
+        "ready": u["ready"],
+        "last_update": _fmt_ts((u["last"] or {}).get("ts",""))
+    } for k,u in sorted(st["users"].items())]
 def remove_user(user_id: int):
-    _ensure()
-    with _lock, open(STATE_FILE, "r") as f:
-        st = json.load(f)
-    st.get("users", {}).pop(str(user_id), None)
-    with open(STATE_FILE, "w") as f:
-        json.dump(st, f, indent=2)
+    with _lock:
+        st = _editable(_load_state())
+        st["users"].pop(int(user_id), None)
+        _save_state(st)
 
 def clear_all_users():
-    _ensure()
-    with _lock, open(STATE_FILE, "r") as f:
-        st = json.load(f)
-    st["users"] = {}
-    with open(STATE_FILE, "w") as f:
-        json.dump(st, f, indent=2)
+    with _lock:
+        st = _editable(_load_state())
+        st["users"] = {}
+        _save_state(st)
 
 def get_progress_for_ids(id_list):
-    _ensure()
-    with open(STATE_FILE, "r") as f:
-        st = json.load(f)
-    target = int(st.get("target", TARGET_SAMPLES))
-    users = st.get("users", {})
+    if not id_list:
+        return []
+    st = _snapshot()
+    target = st["target"]
+    users = st["users"]
     rows = []
     for uid in sorted(id_list):
-        u = users.get(str(uid), {"count": 0, "ready": False})
+        u = users.get(int(uid), _NO_PROGRESS)
         rows.append({
             "user_id": int(uid),
-            "count": int(u.get("count", 0)),
+            "count": u["count"],
             "target": target,
-            "ready": bool(u.get("ready", False)),
+            "ready": u["ready"],
         })
-    return rows
\ No newline at end of file
+    return rows
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("picamera2")
+
+from camera import camera_module
+
+
+def _i420(w, h, y, u, v):
+    frame = np.empty((h * 3 // 2, w), np.uint8)
+    frame[:h] = y
+    frame[h:h + h // 4] = u
+    frame[h + h // 4:] = v
+    return frame
+
+
+def test_ring_frame_matches_main_byte_order():
+    # saturated red; Picamera2 "BGR888" main frames hold it as R,G,B in memory
+    w, h = 64, 32
+    out = camera_module._ring_to_main(_i420(w, h, 81, 90, 240))
+    assert out.shape == (h, w, 3)
+    r, g, b = (int(c) for c in out[h // 2, w // 2])
+    assert r > 200 and g < 60 and b < 60
+
+
+def test_ring_to_main_reuses_dst():
+    w, h = 64, 32
+    dst = np.empty((h, w, 3), np.uint8)
+    out = camera_module._ring_to_main(_i420(w, h, 41, 240, 110), dst)
+    assert out is dst
+    r, g, b = (int(c) for c in dst[h // 2, w // 2])
+    assert b > 200 and r < 60 and g < 60